@@ -0,0 +1,145 @@
+"""Command-line maintenance tasks for the knowledge assistant.
+
+Usage:
+    python -m src.cli snapshot export PATH
+    python -m src.cli snapshot import PATH [--replace] [--reindex]
+    python -m src.cli tune-index [--collection NAME] [--queries FILE] [--m 8,16,32] [--ef-search 10,50,100] ...
+"""
+import argparse
+import json
+import sys
+import time
+from dotenv import load_dotenv
+
+
+def _snapshot_export(args) -> int:
+    from .services.rag_service import RAGService
+    start = time.time()
+    manifest = RAGService().export_snapshot(args.path)
+    print(
+        f"Exported {manifest['count']} chunks from {len(manifest['shards'])} collections "
+        f"to {args.path} in {time.time() - start:.2f}s"
+    )
+    return 0
+
+
+def _snapshot_import(args) -> int:
+    from .services.rag_service import RAGService
+    start = time.time()
+    manifest = RAGService().import_snapshot(args.path, replace=args.replace, reindex=args.reindex)
+    print(
+        f"Imported {manifest['count']} chunks into {len(manifest['shards'])} collections "
+        f"from {args.path} in {time.time() - start:.2f}s"
+    )
+    return 0
+
+
+def _int_list(value: str):
+    try:
+        return [int(item) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a comma-separated list of integers, got {value!r}")
+
+
+def _tune_index(args) -> int:
+    import numpy as np
+    from .services.index_tuning import format_table, split_queries, sweep
+    from .services.rag_service import RAGService
+    from .services.snapshot import read_collection
+
+    # Tuning only reads the store, so it can run next to a live writer
+    rag_service = RAGService(role="reader")
+    shards = rag_service.shards.all_shards()
+    if args.collection:
+        shards = [shard for shard in shards if shard.name == args.collection]
+        if not shards:
+            raise ValueError(f"Collection {args.collection} does not exist")
+
+    # Tune on the vectors already stored, pooled across the selected collections
+    vectors = [read_collection(shard.vectorstore._collection)["embeddings"] for shard in shards]
+    vectors = [v for v in vectors if len(v)]
+    if not vectors:
+        raise ValueError("No stored chunks to tune the index on")
+    corpus = np.concatenate(vectors)
+    if args.max_corpus and len(corpus) > args.max_corpus:
+        corpus = corpus[np.random.RandomState(args.seed).choice(len(corpus), args.max_corpus, replace=False)]
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        if not questions:
+            raise ValueError(f"No queries found in {args.queries}")
+        queries = np.asarray(
+            rag_service.embeddings.embed(questions, task_type="search_query"), dtype="<f4"
+        )
+    else:
+        # Held-out stored chunks stand in for queries and are left out of the index
+        corpus, queries = split_queries(corpus, args.num_queries, args.seed)
+
+    spaces = args.space.split(",") if args.space else [shards[0].config.space]
+    print(f"Tuning on {len(corpus)} vectors with {len(queries)} queries, k={args.k}", file=sys.stderr)
+    rows = sweep(
+        corpus,
+        queries,
+        k=args.k,
+        spaces=spaces,
+        ms=args.m,
+        ef_constructions=args.ef_construction,
+        ef_searches=args.ef_search,
+        candidate_multipliers=args.candidate_multiplier
+    )
+    print(json.dumps(rows, indent=2) if args.json else format_table(rows, min(args.k, len(corpus))))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="Knowledge assistant maintenance tasks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snapshot = commands.add_parser("snapshot", help="Export or import a vector store snapshot")
+    snapshot_commands = snapshot.add_subparsers(dest="snapshot_command", required=True)
+
+    export_parser = snapshot_commands.add_parser("export", help="Write the vector store to a snapshot file")
+    export_parser.add_argument("path", help="Snapshot file to write")
+    export_parser.set_defaults(handler=_snapshot_export)
+
+    import_parser = snapshot_commands.add_parser("import", help="Load a snapshot file into the vector store")
+    import_parser.add_argument("path", help="Snapshot file to read")
+    import_parser.add_argument("--replace", action="store_true", help="Drop existing collections before importing")
+    import_parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Build new collections with the configured index parameters instead of the snapshot's"
+    )
+    import_parser.set_defaults(handler=_snapshot_import)
+
+    tune_parser = commands.add_parser("tune-index", help="Measure recall and latency of HNSW index settings")
+    tune_parser.add_argument("--collection", help="Only tune on this collection (default: all collections)")
+    tune_parser.add_argument("--k", type=int, default=10, help="Results per query used for recall@k")
+    tune_parser.add_argument("--queries", help="File with one query per line (default: held-out stored chunks)")
+    tune_parser.add_argument("--num-queries", type=int, default=100, help="Stored chunks to hold out as queries")
+    tune_parser.add_argument("--max-corpus", type=int, help="Sample at most this many stored vectors")
+    tune_parser.add_argument("--seed", type=int, default=0, help="Random seed for sampling")
+    tune_parser.add_argument("--space", help="Comma-separated distance metrics (default: the collection's)")
+    tune_parser.add_argument("--m", type=_int_list, default=[8, 16, 32], help="Comma-separated HNSW M values")
+    tune_parser.add_argument("--ef-construction", type=_int_list, default=[100, 200], help="Comma-separated ef_construction values")
+    tune_parser.add_argument("--ef-search", type=_int_list, default=[10, 50, 100], help="Comma-separated ef_search values")
+    tune_parser.add_argument("--candidate-multiplier", type=_int_list, default=[1, 2, 4], help="Comma-separated candidate multipliers")
+    tune_parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    tune_parser.set_defaults(handler=_tune_index)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
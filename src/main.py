@@ -1,10 +1,19 @@
-from fastapi import FastAPI, Depends, UploadFile, HTTPException
-from typing import List
+from fastapi import FastAPI, Depends, UploadFile, HTTPException, Query, BackgroundTasks, Form, Header, Response
+from typing import List, Dict, Any, Optional
+import base64
+import hashlib
+import json
+import time
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from .models import ChatRequest, ChatResponse, UploadResponse, UploadResult
-from .services.rag_service import RAGService
+from .models import (
+    ChatRequest, ChatResponse, BatchChatRequest, BatchChatResponse, SearchResponse, UploadResponse, UploadResult,
+    DocumentListResponse, DocumentDeleteResponse, DocumentReplaceResponse, CompactionResponse,
+    ProfileListResponse, ProfileDetail
+)
+from .services.rag_service import SEARCH_DEPTH, RAGService
 from .services.graph_service import KnowledgeAssistant
+from .services.sharding import validate_namespace
 
 # Load environment variables
 load_dotenv()
@@ -25,34 +34,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Upper bounds for batch chat requests
+MAX_BATCH_SIZE = 1000
+MAX_BATCH_CONCURRENCY = 32
+
+# Upper bounds for search pagination; every page is cut from the same fused candidate pool
+MAX_SEARCH_K = 100
+MAX_SEARCH_DEPTH = SEARCH_DEPTH
+
 # Initialize services
 rag_service = RAGService()
 knowledge_assistant = KnowledgeAssistant(rag_service)
 
 # Dependency injection
 def get_rag_service() -> RAGService:
+    # Readers pick up index generations published by the writer process
+    rag_service.refresh_if_stale()
+    return rag_service
+
+def get_writable_rag_service() -> RAGService:
+    if rag_service.read_only:
+        raise HTTPException(
+            status_code=403,
+            detail="This worker serves queries only; send uploads and document changes to the writer process"
+        )
+    return rag_service
+
+def get_profile_reader(x_profile: Optional[str] = Header(None)) -> RAGService:
+    # Profiles hold questions and filenames, so reading them takes the same token as requesting them
+    if not rag_service.profiler.token:
+        raise HTTPException(status_code=404, detail="Profiling is disabled; set PROFILE_HEADER_TOKEN to enable it")
+    if not rag_service.profiler.accepts_token(x_profile):
+        raise HTTPException(status_code=403, detail="Send the profiling token in the X-Profile header")
     return rag_service
 
 def get_knowledge_assistant() -> KnowledgeAssistant:
+    rag_service.refresh_if_stale()
     return knowledge_assistant
 
+def _check_namespace(namespace: Optional[str]) -> Optional[str]:
+    """Reject namespaces that cannot be mapped to a shard."""
+    if namespace is None:
+        return None
+    try:
+        return validate_namespace(namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _profile_requested(rag_service: RAGService, x_profile: Optional[str]) -> bool:
+    """Whether the client asked for this request to be profiled, with the configured PROFILE_HEADER_TOKEN."""
+    return rag_service.profiler.accepts_token(x_profile)
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
-    return {"message": "Mini Knowledge Assistant is running!"}
+    return {
+        "message": "Mini Knowledge Assistant is running!",
+        "role": rag_service.role,
+        "index_generation": rag_service.generation
+    }
 
 @app.post("/upload", response_model=UploadResponse)
 async def upload_documents(
     files: List[UploadFile],
-    rag_service: RAGService = Depends(get_rag_service)
+    response: Response,
+    namespace: Optional[str] = Form(None),
+    x_profile: Optional[str] = Header(None),
+    rag_service: RAGService = Depends(get_writable_rag_service)
 ):
     """Upload and process multiple documents."""
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
+    _check_namespace(namespace)
     
     results = []
     successful_uploads = []
     failed_uploads = []
+    profile_ids = []
     
     for file in files:
         try:
@@ -62,7 +120,10 @@ async def upload_documents(
                 raise ValueError(f"Unsupported file type: {file.filename}")
             
             content = await file.read()
-            await rag_service.process_document(content, file.filename)
+            profile_id = rag_service.profiler.new_profile_id(_profile_requested(rag_service, x_profile))
+            if profile_id:
+                profile_ids.append(profile_id)
+            await rag_service.process_document(content, file.filename, namespace=namespace, profile_id=profile_id)
             
             result = UploadResult(
                 filename=file.filename,
@@ -80,6 +141,9 @@ async def upload_documents(
             failed_uploads.append(result)
             results.append(result)
     
+    if profile_ids:
+        response.headers["X-Profile-Id"] = ",".join(profile_ids)
+    
     # Prepare response
     total_processed = len(files)
     success_count = len(successful_uploads)
@@ -112,42 +176,261 @@ async def upload_documents(
             detail=f"All {failure_count} document uploads failed: {'; '.join(error_details)}"
         )
 
+def _build_chat_response(detailed_response: Dict[str, Any]) -> ChatResponse:
+    """Convert a workflow result into a ChatResponse."""
+    # Convert execution log to the proper format
+    execution_log = [
+        {
+            "step": log["step"],
+            "status": log["status"],
+            "details": log["details"],
+            "timestamp": log["timestamp"]
+        }
+        for log in detailed_response.get("execution_log", [])
+    ]
+    
+    # Convert sources to the proper format
+    sources_used = [
+        {
+            "source": source["source"],
+            "content_preview": source["content_preview"],
+            "relevance_score": source.get("relevance_score")
+        }
+        for source in detailed_response.get("sources_used", [])
+    ]
+    
+    return ChatResponse(
+        response=detailed_response["answer"],
+        execution_log=execution_log,
+        sources_used=sources_used,
+        workflow_path=detailed_response.get("workflow_path", []),
+        total_execution_time=detailed_response.get("total_execution_time", 0.0)
+    )
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
+    response: Response,
+    x_profile: Optional[str] = Header(None),
     knowledge_assistant: KnowledgeAssistant = Depends(get_knowledge_assistant)
 ):
     """Process a chat message and return a response."""
+    _check_namespace(request.namespace)
+    profile_id = knowledge_assistant.rag_service.profiler.new_profile_id(
+        _profile_requested(knowledge_assistant.rag_service, x_profile)
+    )
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
     try:
-        detailed_response = await knowledge_assistant.process_question(request.message)
-        
-        # Convert execution log to the proper format
-        execution_log = [
-            {
-                "step": log["step"],
-                "status": log["status"],
-                "details": log["details"],
-                "timestamp": log["timestamp"]
-            }
-            for log in detailed_response.get("execution_log", [])
-        ]
-        
-        # Convert sources to the proper format
-        sources_used = [
-            {
-                "source": source["source"],
-                "content_preview": source["content_preview"],
-                "relevance_score": source.get("relevance_score")
-            }
-            for source in detailed_response.get("sources_used", [])
-        ]
-        
-        return ChatResponse(
-            response=detailed_response["answer"],
-            execution_log=execution_log,
-            sources_used=sources_used,
-            workflow_path=detailed_response.get("workflow_path", []),
-            total_execution_time=detailed_response.get("total_execution_time", 0.0)
+        detailed_response = await knowledge_assistant.process_question(
+            request.message, namespace=request.namespace, profile_id=profile_id
         )
+        return _build_chat_response(detailed_response)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(
+    request: BatchChatRequest,
+    knowledge_assistant: KnowledgeAssistant = Depends(get_knowledge_assistant)
+):
+    """Process many chat messages with shared embedding and retrieval work."""
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages provided")
+    if len(request.messages) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many messages: {len(request.messages)} (maximum is {MAX_BATCH_SIZE})"
+        )
+    _check_namespace(request.namespace)
+    max_concurrency = min(max(request.max_concurrency, 1), MAX_BATCH_CONCURRENCY)
+    
+    start_time = time.time()
+    try:
+        results = await knowledge_assistant.process_questions(
+            request.messages, max_concurrency=max_concurrency, namespace=request.namespace
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    responses = []
+    failure_count = 0
+    for result in results:
+        if isinstance(result, Exception):
+            # Report the failure for this question without failing the whole batch
+            failure_count += 1
+            responses.append(ChatResponse(
+                response="An error occurred while processing your question.",
+                execution_log=[{
+                    "step": "workflow_error",
+                    "status": "error",
+                    "details": {"error": str(result)},
+                    "timestamp": 0.0
+                }],
+                sources_used=[],
+                workflow_path=[],
+                total_execution_time=0.0
+            ))
+        else:
+            responses.append(_build_chat_response(result))
+    
+    return BatchChatResponse(
+        responses=responses,
+        total_questions=len(request.messages),
+        success_count=len(request.messages) - failure_count,
+        failure_count=failure_count,
+        total_execution_time=time.time() - start_time
+    )
+
+def _search_fingerprint(query: str, sources: Optional[List[str]], namespace: Optional[str]) -> str:
+    """Identify a search so cursors cannot be replayed against a different one."""
+    key = json.dumps([query, sorted(sources or []), namespace])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+def _encode_cursor(offset: int, fingerprint: str) -> str:
+    payload = json.dumps({"offset": offset, "search": fingerprint})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor: str, fingerprint: str) -> int:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        offset = int(payload["offset"])
+        search = payload["search"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if search != fingerprint or offset < 0:
+        raise HTTPException(status_code=400, detail="Cursor does not match this search")
+    return offset
+
+@app.get("/search", response_model=SearchResponse)
+async def search(
+    q: str,
+    k: int = 10,
+    cursor: Optional[str] = None,
+    source: Optional[List[str]] = Query(None),
+    namespace: Optional[str] = None,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """Return ranked chunks from hybrid retrieval without calling the LLM."""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    _check_namespace(namespace)
+    if k < 1 or k > MAX_SEARCH_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {MAX_SEARCH_K}")
+    
+    fingerprint = _search_fingerprint(q, source, namespace)
+    offset = _decode_cursor(cursor, fingerprint) if cursor else 0
+    if offset >= MAX_SEARCH_DEPTH:
+        raise HTTPException(status_code=400, detail=f"Cannot page beyond {MAX_SEARCH_DEPTH} results")
+    # The last page stops at the depth limit
+    k = min(k, MAX_SEARCH_DEPTH - offset)
+    
+    start_time = time.time()
+    try:
+        results, has_more = await rag_service.search(
+            q, k=k, offset=offset, sources=source, namespace=namespace, depth=MAX_SEARCH_DEPTH
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return SearchResponse(
+        query=q,
+        results=results,
+        next_cursor=_encode_cursor(offset + k, fingerprint) if has_more and offset + k < MAX_SEARCH_DEPTH else None,
+        total_execution_time=time.time() - start_time
+    )
+
+@app.get("/documents", response_model=DocumentListResponse)
+async def list_documents(
+    namespace: Optional[str] = None,
+    rag_service: RAGService = Depends(get_rag_service)
+):
+    """List stored documents and their chunk counts."""
+    _check_namespace(namespace)
+    try:
+        documents = await rag_service.list_documents(namespace=namespace)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return DocumentListResponse(
+        namespace=namespace,
+        documents=documents,
+        total_documents=len(documents),
+        total_chunks=sum(document["chunk_count"] for document in documents)
+    )
+
+@app.post("/documents/compact", response_model=CompactionResponse)
+def compact_documents(rag_service: RAGService = Depends(get_writable_rag_service)):
+    """Rebuild the vector indexes without deleted chunks and reclaim disk space."""
+    # A plain def runs in the threadpool, so the rebuild never blocks the event loop
+    try:
+        return CompactionResponse(**rag_service.compact())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents/{source:path}", response_model=DocumentDeleteResponse)
+async def delete_document(
+    source: str,
+    background_tasks: BackgroundTasks,
+    namespace: Optional[str] = None,
+    rag_service: RAGService = Depends(get_writable_rag_service)
+):
+    """Delete a document and all of its chunks."""
+    _check_namespace(namespace)
+    try:
+        chunks_deleted = await rag_service.delete_document(source, namespace=namespace)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if chunks_deleted == 0:
+        raise HTTPException(status_code=404, detail=f"Document not found: {source}")
+    
+    background_tasks.add_task(rag_service.compact_if_needed)
+    return DocumentDeleteResponse(source=source, chunks_deleted=chunks_deleted)
+
+@app.put("/documents/{source:path}", response_model=DocumentReplaceResponse)
+async def replace_document(
+    source: str,
+    file: UploadFile,
+    background_tasks: BackgroundTasks,
+    namespace: Optional[str] = None,
+    rag_service: RAGService = Depends(get_writable_rag_service)
+):
+    """Replace a document with a new version, stored under the same source name."""
+    _check_namespace(namespace)
+    from .utils.file_loader import FileLoader
+    if not FileLoader.validate_file_type(source):
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {source}")
+    
+    try:
+        content = await file.read()
+        chunks_deleted, chunks_added = await rag_service.replace_document(content, source, namespace=namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    background_tasks.add_task(rag_service.compact_if_needed)
+    return DocumentReplaceResponse(source=source, chunks_deleted=chunks_deleted, chunks_added=chunks_added)
+
+@app.get("/debug/profiles", response_model=ProfileListResponse)
+async def list_profiles(
+    kind: Optional[str] = None,
+    rag_service: RAGService = Depends(get_profile_reader)
+):
+    """List recent request profiles held by this worker, newest first."""
+    return ProfileListResponse(
+        profiles=rag_service.profiler.list_profiles(kind),
+        capacity=rag_service.profiler.capacity,
+        sample_rate=rag_service.profiler.sample_rate
+    )
+
+@app.get("/debug/profiles/{profile_id}", response_model=ProfileDetail)
+async def get_profile(
+    profile_id: str,
+    rag_service: RAGService = Depends(get_profile_reader)
+):
+    """Return one request profile with its function statistics."""
+    profile = rag_service.profiler.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return ProfileDetail(**profile)
@@ -3,6 +3,12 @@ from typing import List, Dict, Any, Optional
 
 class ChatRequest(BaseModel):
     message: str
+    namespace: Optional[str] = None
+
+class BatchChatRequest(BaseModel):
+    messages: List[str]
+    max_concurrency: int = 4
+    namespace: Optional[str] = None
 
 class ExecutionStep(BaseModel):
     step: str
@@ -22,6 +28,27 @@ class ChatResponse(BaseModel):
     workflow_path: List[str]
     total_execution_time: float
 
+class BatchChatResponse(BaseModel):
+    responses: List[ChatResponse]
+    total_questions: int
+    success_count: int
+    failure_count: int
+    total_execution_time: float
+
+class SearchResult(BaseModel):
+    source: str
+    content: str
+    metadata: Dict[str, Any]
+    score: float
+    vector_distance: Optional[float] = None
+    keyword_score: Optional[float] = None
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
+    total_execution_time: float
+
 class UploadResult(BaseModel):
     filename: str
     status: str
@@ -33,4 +60,62 @@ class UploadResponse(BaseModel):
     failed_uploads: Optional[List[UploadResult]] = None
     total_processed: int
     success_count: int
-    failure_count: int
\ No newline at end of file
+    failure_count: int
+
+class DocumentInfo(BaseModel):
+    source: str
+    chunk_count: int
+
+class DocumentListResponse(BaseModel):
+    namespace: Optional[str] = None
+    documents: List[DocumentInfo]
+    total_documents: int
+    total_chunks: int
+
+class DocumentDeleteResponse(BaseModel):
+    source: str
+    chunks_deleted: int
+
+class DocumentReplaceResponse(BaseModel):
+    source: str
+    chunks_deleted: int
+    chunks_added: int
+
+class CompactionResponse(BaseModel):
+    status: str
+    deleted_chunks: int
+    rebuilt_collections: List[str] = []
+    bytes_before: Optional[int] = None
+    bytes_after: Optional[int] = None
+
+class ProfileStage(BaseModel):
+    name: str
+    offset: float
+    wall_time: float
+    cpu_time: float
+
+class ProfileFunction(BaseModel):
+    function: str
+    calls: int
+    primitive_calls: int
+    total_time: float
+    cumulative_time: float
+
+class ProfileSummary(BaseModel):
+    id: str
+    kind: str
+    label: str
+    started_at: float
+    wall_time: float
+    cpu_time: float
+    profiler: str
+    error: Optional[str] = None
+    stages: List[ProfileStage]
+
+class ProfileDetail(ProfileSummary):
+    functions: List[ProfileFunction]
+
+class ProfileListResponse(BaseModel):
+    profiles: List[ProfileSummary]
+    capacity: int
+    sample_rate: float
@@ -0,0 +1,186 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import base64
+import itertools
+import re
+import threading
+import zlib
+import numpy as np
+
+# Ingest-time collapsing scopes
+DEDUP_OFF = "off"
+DEDUP_DOCUMENT = "document"  # only within the document being ingested
+DEDUP_SHARD = "shard"  # against everything already stored in the target shard
+DEDUP_SCOPES = (DEDUP_OFF, DEDUP_DOCUMENT, DEDUP_SHARD)
+
+# Mersenne prime for the universal hash family; keeps a * h + b below 2**64 for 32-bit shingle hashes
+_PRIME = (1 << 31) - 1
+
+# Chunk metadata key holding the MinHash signature computed at ingest
+SIGNATURE_METADATA_KEY = "minhash"
+
+
+def encode_signature(signature: np.ndarray) -> str:
+    """Pack a signature into a metadata string. Every value is below ``_PRIME``, so 32 bits suffice."""
+    return base64.b64encode(signature.astype("<u4").tobytes()).decode("ascii")
+
+
+def decode_signature(value: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(value), dtype="<u4").astype(np.uint64)
+
+
+class MinHasher:
+    """MinHash signatures over lowercased word shingles."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # Fixed seed so signatures are comparable across processes and restarts
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = generator.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+
+    @staticmethod
+    def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+        """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+        return float(np.mean(signature == other))
+
+
+class LSHIndex:
+    """Banded locality-sensitive hashing index over MinHash signatures.
+
+    Candidates that share at least one band are verified against
+    ``threshold`` with the estimated Jaccard similarity.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.8):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def keys(self) -> Set[str]:
+        with self._lock:
+            return set(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key: str, signature: np.ndarray):
+        with self._lock:
+            if key in self._signatures:
+                self._remove_locked(key)
+            self._signatures[key] = signature
+            for band, band_key in enumerate(self._band_keys(signature)):
+                self._buckets[band].setdefault(band_key, set()).add(key)
+
+    def remove(self, keys: Iterable[str]):
+        with self._lock:
+            for key in keys:
+                self._remove_locked(key)
+
+    def _remove_locked(self, key: str):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def query(self, signature: np.ndarray) -> Optional[str]:
+        """Return the key of a stored near-duplicate of ``signature``, or None."""
+        with self._lock:
+            candidates: Set[str] = set()
+            for band, band_key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(band_key, ()))
+            for key in candidates:
+                if MinHasher.similarity(signature, self._signatures[key]) >= self.threshold:
+                    return key
+        return None
+
+
+class NearDuplicateFilter:
+    """Computes signatures and collapses near-duplicate texts with shared settings."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: int = 16):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.hasher = MinHasher(num_perm=num_perm)
+
+    def new_index(self) -> LSHIndex:
+        return LSHIndex(num_perm=self.num_perm, bands=self.bands, threshold=self.threshold)
+
+    def stored_signature(self, metadata: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Signature saved in a chunk's metadata at ingest, or None if it has none with these settings."""
+        value = (metadata or {}).get(SIGNATURE_METADATA_KEY)
+        if not isinstance(value, str):
+            return None
+        try:
+            signature = decode_signature(value)
+        except ValueError:
+            return None
+        return signature if len(signature) == self.num_perm else None
+
+    def signature(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Return a chunk's stored signature, hashing its text only when none was stored."""
+        signature = self.stored_signature(metadata)
+        return signature if signature is not None else self.hasher.signature(text)
+
+    def build_index(
+        self,
+        ids: Iterable[str],
+        texts: Iterable[str],
+        metadatas: Optional[Iterable[Optional[Dict[str, Any]]]] = None
+    ) -> LSHIndex:
+        index = self.new_index()
+        metadatas = metadatas if metadatas is not None else itertools.repeat(None)
+        for key, text, metadata in zip(ids, texts, metadatas):
+            if text:
+                index.add(key, self.signature(text, metadata))
+        return index
+
+    def near_duplicate_mask(
+        self,
+        texts: List[str],
+        existing: Optional[LSHIndex] = None,
+        metadatas: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> Tuple[List[bool], List[np.ndarray]]:
+        """Flag which texts to keep (the first of every near-duplicate group) and return their signatures.
+
+        Texts that are near-duplicates of an entry in ``existing`` are dropped too.
+        Signatures stored in ``metadatas`` are reused instead of hashing the texts.
+        """
+        seen = self.new_index()
+        keep = []
+        signatures = []
+        for i, text in enumerate(texts):
+            signature = self.signature(text, metadatas[i] if metadatas is not None else None)
+            duplicate = seen.query(signature) is not None or (existing is not None and existing.query(signature) is not None)
+            if not duplicate:
+                seen.add(str(i), signature)
+            keep.append(not duplicate)
+            signatures.append(signature)
+        return keep, signatures
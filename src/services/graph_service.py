@@ -2,6 +2,7 @@ from typing import Dict, List, Tuple, Any, TypedDict, Optional
 from langgraph.graph import StateGraph
 from langchain_groq import ChatGroq
 from langchain.schema import Document
+from .profiling import stage
 from .rag_service import RAGService
 import google.generativeai as genai
 import os
@@ -17,6 +18,8 @@ class State(TypedDict):
     workflow_path: List[str]
     start_time: float
     sources_used: List[Dict[str, Any]]
+    prefetched: Optional[Tuple[Any, Any]]
+    namespace: Optional[str]
 
 class KnowledgeAssistant:
     def __init__(self, rag_service: RAGService):
@@ -37,9 +40,9 @@ class KnowledgeAssistant:
         workflow = StateGraph(State)
 
         # Add nodes
-        workflow.add_node("retrieve_context", self._retrieve_context)
-        workflow.add_node("generate_answer", self._generate_answer)
-        workflow.add_node("fallback", self._fallback)
+        workflow.add_node("retrieve_context", self._timed_node("retrieve_context", self._retrieve_context))
+        workflow.add_node("generate_answer", self._timed_node("generate_answer", self._generate_answer))
+        workflow.add_node("fallback", self._timed_node("fallback", self._fallback))
 
         # Add conditional edges (no regular edges needed when using conditional edges)
         workflow.add_conditional_edges(
@@ -61,6 +64,14 @@ class KnowledgeAssistant:
         # Compile the graph
         return workflow.compile()
 
+    @staticmethod
+    def _timed_node(name: str, node):
+        """Wrap a workflow node so profiled requests record its wall and CPU time."""
+        async def timed(state: State) -> State:
+            with stage(name):
+                return await node(state)
+        return timed
+
     async def _retrieve_context(self, state: State) -> State:
         """Retrieve context using parallel retrievers."""
         import asyncio
@@ -74,21 +85,32 @@ class KnowledgeAssistant:
         workflow_path.append("retrieve_context")
         
         try:
-            # Log start of parallel retrieval
-            execution_log.append({
-                "step": "retrieve_context_start",
-                "status": "running",
-                "details": {"message": "Starting parallel retrieval (vector + keyword search)"},
-                "timestamp": time.time() - state.get("start_time", time.time())
-            })
-            
-            # Run retrievers in parallel using asyncio.gather
+            prefetched = state.get("prefetched")
             vector_start = time.time()
-            vector_results, keyword_results = await asyncio.gather(
-                self.rag_service.retrieve_relevant_chunks_with_scores(question),
-                self.rag_service.keyword_search(question),
-                return_exceptions=True
-            )
+            if prefetched is not None:
+                # Retrieval was already done for the whole batch, reuse its results
+                execution_log.append({
+                    "step": "retrieve_context_start",
+                    "status": "running",
+                    "details": {"message": "Using batched retrieval results (vector + keyword search)"},
+                    "timestamp": time.time() - state.get("start_time", time.time())
+                })
+                vector_results, keyword_results = prefetched
+            else:
+                # Log start of parallel retrieval
+                execution_log.append({
+                    "step": "retrieve_context_start",
+                    "status": "running",
+                    "details": {"message": "Starting parallel retrieval (vector + keyword search)"},
+                    "timestamp": time.time() - state.get("start_time", time.time())
+                })
+                
+                # Run retrievers in parallel using asyncio.gather
+                vector_results, keyword_results = await asyncio.gather(
+                    self.rag_service.retrieve_relevant_chunks_with_scores(question, namespace=state.get("namespace")),
+                    self.rag_service.keyword_search(question, namespace=state.get("namespace")),
+                    return_exceptions=True
+                )
             retrieval_time = time.time() - vector_start
             
             # Handle exceptions from parallel execution
@@ -137,7 +159,9 @@ class KnowledgeAssistant:
                 })
             
             # Merge and deduplicate results (prioritize vector results for scores)
-            all_results = list({doc.page_content: doc for doc in vector_docs + keyword_results}.values())
+            exact_unique = list({doc.page_content: doc for doc in vector_docs + keyword_results}.values())
+            # Collapse near-duplicates (boilerplate, overlapping chunks) so they don't crowd the prompt
+            all_results = await asyncio.to_thread(self.rag_service.collapse_near_duplicates, exact_unique)
             
             # Log sources used with actual relevance scores
             for i, doc in enumerate(all_results):
@@ -164,7 +188,8 @@ class KnowledgeAssistant:
                     "total_chunks_found": len(all_results),
                     "vector_chunks": vector_count,
                     "keyword_chunks": keyword_count,
-                    "duplicates_removed": len(vector_results) + len(keyword_results) - len(all_results)
+                    "duplicates_removed": len(vector_results) + len(keyword_results) - len(exact_unique),
+                    "near_duplicates_removed": len(exact_unique) - len(all_results)
                 },
                 "timestamp": time.time() - state.get("start_time", time.time())
             })
@@ -345,8 +370,29 @@ class KnowledgeAssistant:
             "workflow_path": workflow_path
         }
 
-    async def process_question(self, question: str) -> Dict[str, Any]:
-        """Process a question through the workflow."""
+    async def process_question(
+        self,
+        question: str,
+        prefetched: Optional[Tuple[Any, Any]] = None,
+        namespace: Optional[str] = None,
+        profile_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Process a question through the workflow.
+
+        ``prefetched`` is an optional ``(vector_results, keyword_results)`` pair
+        from batched retrieval; when given, the retrieval node skips its own search.
+        ``namespace`` limits retrieval to that namespace's shard. When
+        ``profile_id`` is set the question is profiled under that id.
+        """
+        with self.rag_service.profiler.session(profile_id, "chat", question[:200]):
+            return await self._run_workflow(question, prefetched, namespace)
+
+    async def _run_workflow(
+        self,
+        question: str,
+        prefetched: Optional[Tuple[Any, Any]],
+        namespace: Optional[str]
+    ) -> Dict[str, Any]:
         start_time = time.time()
         
         initial_state: State = {
@@ -357,7 +403,9 @@ class KnowledgeAssistant:
             "execution_log": [],
             "workflow_path": [],
             "start_time": start_time,
-            "sources_used": []
+            "sources_used": [],
+            "prefetched": prefetched,
+            "namespace": namespace
         }
         
         # Log workflow start
@@ -385,4 +433,41 @@ class KnowledgeAssistant:
             "sources_used": result.get("sources_used", []),
             "workflow_path": result.get("workflow_path", []),
             "total_execution_time": total_time
-        }
\ No newline at end of file
+        }
+
+    async def process_questions(
+        self,
+        questions: List[str],
+        max_concurrency: int = 4,
+        namespace: Optional[str] = None
+    ) -> List[Any]:
+        """Process many questions, sharing embedding and retrieval work across the batch.
+
+        Returns one result per question, in order. A question whose workflow
+        raised is returned as the exception instead of a result dict.
+        """
+        import asyncio
+        
+        # One batched embedding call and one multi-query vector search for the whole batch
+        vector_batch, keyword_batch = await asyncio.gather(
+            self.rag_service.retrieve_relevant_chunks_with_scores_batch(questions, namespace=namespace),
+            self.rag_service.keyword_search_batch(questions, namespace=namespace),
+            return_exceptions=True
+        )
+        
+        # Generations hit the LLM API, so bound how many run at once
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(i: int, question: str) -> Dict[str, Any]:
+            # A failed batch retrieval is passed through so the node logs it per question
+            vector_results = vector_batch if isinstance(vector_batch, Exception) else vector_batch[i]
+            keyword_results = keyword_batch if isinstance(keyword_batch, Exception) else keyword_batch[i]
+            async with semaphore:
+                return await self.process_question(
+                    question, prefetched=(vector_results, keyword_results), namespace=namespace
+                )
+        
+        return await asyncio.gather(
+            *(run(i, question) for i, question in enumerate(questions)),
+            return_exceptions=True
+        )
\ No newline at end of file
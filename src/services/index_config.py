@@ -0,0 +1,135 @@
+from typing import Any, Dict, Optional
+import json
+import os
+
+# Distance metrics supported by Chroma's HNSW index
+SPACES = ("l2", "cosine", "ip")
+
+# Relevance cutoff per metric when none is configured. Chroma's l2 is the squared
+# distance, which for unit vectors is twice the cosine distance.
+DEFAULT_MAX_DISTANCE = {"l2": 1.2, "cosine": 0.6, "ip": 0.6}
+
+# Settings CHROMA_INDEX_CONFIG may override per collection
+CONFIG_FIELDS = ("space", "m", "ef_construction", "ef_search", "candidate_multiplier", "max_distance")
+
+
+class IndexConfig:
+    """HNSW index parameters and retrieval knobs for one Chroma collection.
+
+    ``space``, ``m``, ``ef_construction`` and ``ef_search`` become the
+    collection's ``hnsw:*`` metadata and take effect when the collection is
+    created. ``candidate_multiplier`` sets how many nearest neighbours are fetched
+    per requested result before the ``max_distance`` relevance cutoff is applied.
+    """
+
+    def __init__(
+        self,
+        space: str = "l2",
+        m: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 10,
+        candidate_multiplier: int = 2,
+        max_distance: Optional[float] = None
+    ):
+        if space not in SPACES:
+            raise ValueError(f"Invalid distance metric: {space}. Expected one of {', '.join(SPACES)}")
+        if m < 2 or ef_construction < 1 or ef_search < 1 or candidate_multiplier < 1:
+            raise ValueError("m must be at least 2; ef_construction, ef_search and candidate_multiplier at least 1")
+        self.space = space
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.candidate_multiplier = candidate_multiplier
+        self.max_distance = max_distance if max_distance is not None else DEFAULT_MAX_DISTANCE[space]
+
+    def __repr__(self) -> str:
+        return (
+            f"IndexConfig(space={self.space!r}, m={self.m}, ef_construction={self.ef_construction}, "
+            f"ef_search={self.ef_search}, candidate_multiplier={self.candidate_multiplier}, "
+            f"max_distance={self.max_distance})"
+        )
+
+    def collection_metadata(self) -> Dict[str, Any]:
+        """Chroma collection metadata that builds the index with these parameters."""
+        return {
+            "hnsw:space": self.space,
+            "hnsw:M": self.m,
+            "hnsw:construction_ef": self.ef_construction,
+            "hnsw:search_ef": self.ef_search
+        }
+
+    def with_collection_metadata(self, metadata: Optional[Dict[str, Any]]) -> "IndexConfig":
+        """Return this config adjusted to the parameters an existing index was built with.
+
+        ``metadata`` holds the index's ``hnsw:*`` parameters; missing ones are
+        Chroma's defaults. They win over the configured values, since Chroma
+        fixes them when the collection is created. The relevance cutoff follows
+        the index's metric unless it was configured explicitly.
+        """
+        metadata = metadata or {}
+        space = metadata.get("hnsw:space", "l2")
+        max_distance = self.max_distance
+        if space != self.space and max_distance == DEFAULT_MAX_DISTANCE[self.space]:
+            max_distance = None
+        return IndexConfig(
+            space=space,
+            m=metadata.get("hnsw:M", 16),
+            ef_construction=metadata.get("hnsw:construction_ef", 100),
+            ef_search=metadata.get("hnsw:search_ef", 10),
+            candidate_multiplier=self.candidate_multiplier,
+            max_distance=max_distance
+        )
+
+    @classmethod
+    def from_env(cls, collection_name: Optional[str] = None, shared_space: bool = False) -> "IndexConfig":
+        """Build the config for a collection from the environment.
+
+        ``CHROMA_HNSW_*`` and ``RETRIEVAL_*`` variables set the defaults, and
+        ``CHROMA_INDEX_CONFIG`` (JSON mapping collection names to field
+        overrides) adjusts individual collections. ``shared_space`` marks a
+        collection whose distances are merged with other collections', so its
+        metric cannot be overridden on its own.
+        """
+        values: Dict[str, Any] = {
+            "space": os.getenv("CHROMA_HNSW_SPACE", "l2"),
+            "m": int(os.getenv("CHROMA_HNSW_M", "16")),
+            "ef_construction": int(os.getenv("CHROMA_HNSW_EF_CONSTRUCTION", "100")),
+            "ef_search": int(os.getenv("CHROMA_HNSW_EF_SEARCH", "10")),
+            "candidate_multiplier": int(os.getenv("RETRIEVAL_CANDIDATE_MULTIPLIER", "2"))
+        }
+        if os.getenv("RETRIEVAL_MAX_DISTANCE"):
+            values["max_distance"] = float(os.getenv("RETRIEVAL_MAX_DISTANCE"))
+
+        if collection_name:
+            settings = cls.collection_overrides().get(collection_name, {})
+            if shared_space and "space" in settings:
+                raise ValueError(
+                    f"CHROMA_INDEX_CONFIG cannot set space for {collection_name}: hash shards are searched "
+                    "together and their distances must be comparable, set CHROMA_HNSW_SPACE instead"
+                )
+            values.update(settings)
+        try:
+            return cls(**values)
+        except TypeError as e:
+            raise ValueError(f"Invalid index settings for {collection_name or 'collections'}: {e}")
+
+    @staticmethod
+    def collection_overrides() -> Dict[str, Dict[str, Any]]:
+        """Parse ``CHROMA_INDEX_CONFIG`` into per-collection settings, rejecting unknown ones."""
+        overrides = os.getenv("CHROMA_INDEX_CONFIG")
+        if not overrides:
+            return {}
+        try:
+            per_collection = json.loads(overrides)
+        except ValueError:
+            per_collection = None
+        if not isinstance(per_collection, dict) or not all(isinstance(v, dict) for v in per_collection.values()):
+            raise ValueError("CHROMA_INDEX_CONFIG must be a JSON object mapping collection names to settings")
+        for name, settings in per_collection.items():
+            unknown = sorted(set(settings) - set(CONFIG_FIELDS))
+            if unknown:
+                raise ValueError(
+                    f"Unknown CHROMA_INDEX_CONFIG settings for {name}: {', '.join(unknown)}. "
+                    f"Expected any of {', '.join(CONFIG_FIELDS)}"
+                )
+        return per_collection
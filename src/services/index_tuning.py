@@ -0,0 +1,121 @@
+from typing import Any, Dict, List, Sequence, Set, Tuple
+import itertools
+import time
+import uuid
+import chromadb
+import numpy as np
+from .index_config import IndexConfig
+
+# Vectors added to a tuning collection per call
+TUNING_BATCH_SIZE = 1000
+
+
+def split_queries(embeddings: np.ndarray, num_queries: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Hold out ``num_queries`` stored vectors as queries and return ``(corpus, queries)``."""
+    if len(embeddings) < 2:
+        raise ValueError("Need at least 2 stored chunks to tune the index")
+    num_queries = min(num_queries, len(embeddings) // 2)
+    order = np.random.RandomState(seed).permutation(len(embeddings))
+    return embeddings[order[num_queries:]], embeddings[order[:num_queries]]
+
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int, space: str) -> List[Set[int]]:
+    """Brute-force top-k neighbours of every query, using Chroma's definition of each metric."""
+    corpus = corpus.astype(np.float64)
+    queries = queries.astype(np.float64)
+    if space == "l2":
+        distances = (queries ** 2).sum(axis=1)[:, None] + (corpus ** 2).sum(axis=1)[None, :] - 2 * queries @ corpus.T
+    elif space == "cosine":
+        corpus_norm = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        queries_norm = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        distances = 1 - queries_norm @ corpus_norm.T
+    elif space == "ip":
+        distances = 1 - queries @ corpus.T
+    else:
+        raise ValueError(f"Invalid distance metric: {space}")
+
+    k = min(k, corpus.shape[0])
+    nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in nearest]
+
+
+def sweep(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    spaces: Sequence[str] = ("l2",),
+    ms: Sequence[int] = (16,),
+    ef_constructions: Sequence[int] = (100,),
+    ef_searches: Sequence[int] = (10,),
+    candidate_multipliers: Sequence[int] = (2,)
+) -> List[Dict[str, Any]]:
+    """Measure recall@k and query latency for every combination of index parameters.
+
+    Each ``(space, M, ef_construction, ef_search)`` combination is built as a
+    throwaway in-memory Chroma collection holding ``corpus``. Every candidate
+    multiplier is then queried against it one query at a time, the way the
+    service queries a shard.
+    """
+    client = chromadb.EphemeralClient()
+    ids = [str(i) for i in range(len(corpus))]
+    k = min(k, len(corpus))
+    rows = []
+
+    for space in spaces:
+        truth = exact_neighbors(corpus, queries, k, space)
+        for m, ef_construction, ef_search in itertools.product(ms, ef_constructions, ef_searches):
+            config = IndexConfig(space=space, m=m, ef_construction=ef_construction, ef_search=ef_search)
+            name = f"tune_{uuid.uuid4().hex[:16]}"
+            build_start = time.perf_counter()
+            collection = client.create_collection(name, metadata=config.collection_metadata())
+            try:
+                for start in range(0, len(corpus), TUNING_BATCH_SIZE):
+                    collection.add(
+                        ids=ids[start:start + TUNING_BATCH_SIZE],
+                        embeddings=corpus[start:start + TUNING_BATCH_SIZE].tolist()
+                    )
+                build_seconds = time.perf_counter() - build_start
+
+                for multiplier in candidate_multipliers:
+                    latencies = []
+                    hits = 0
+                    for query, expected in zip(queries, truth):
+                        query_start = time.perf_counter()
+                        result = collection.query(
+                            query_embeddings=[query.tolist()],
+                            n_results=min(k * multiplier, len(corpus)),
+                            include=["distances"]
+                        )
+                        latencies.append(time.perf_counter() - query_start)
+                        # Results come back closest first, the service keeps the top k
+                        hits += len(expected.intersection(int(i) for i in result["ids"][0][:k]))
+                    rows.append({
+                        "space": space,
+                        "m": m,
+                        "ef_construction": ef_construction,
+                        "ef_search": ef_search,
+                        "candidate_multiplier": multiplier,
+                        "recall": hits / (k * len(queries)) if len(queries) else 0.0,
+                        "p50_ms": float(np.percentile(latencies, 50) * 1000) if latencies else 0.0,
+                        "p99_ms": float(np.percentile(latencies, 99) * 1000) if latencies else 0.0,
+                        "build_seconds": build_seconds
+                    })
+            finally:
+                client.delete_collection(name)
+    return rows
+
+
+def format_table(rows: List[Dict[str, Any]], k: int) -> str:
+    """Render sweep results as an aligned text table."""
+    headers = ["space", "M", "ef_construction", "ef_search", "multiplier", f"recall@{k}", "p50 ms", "p99 ms", "build s"]
+    lines = [
+        [
+            row["space"], str(row["m"]), str(row["ef_construction"]), str(row["ef_search"]),
+            str(row["candidate_multiplier"]), f"{row['recall']:.4f}", f"{row['p50_ms']:.3f}",
+            f"{row['p99_ms']:.3f}", f"{row['build_seconds']:.2f}"
+        ]
+        for row in rows
+    ]
+    widths = [max(len(cell) for cell in column) for column in zip(headers, *lines)]
+    render = lambda cells: "  ".join(cell.rjust(width) for cell, width in zip(cells, widths))
+    return "\n".join([render(headers), render(["-" * width for width in widths])] + [render(line) for line in lines])
@@ -0,0 +1,105 @@
+from typing import Optional
+import json
+import os
+import time
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Serving roles: one writer owns ingestion, readers only answer queries
+ROLE_STANDALONE = "standalone"
+ROLE_WRITER = "writer"
+ROLE_READER = "reader"
+ROLES = (ROLE_STANDALONE, ROLE_WRITER, ROLE_READER)
+
+VERSION_FILENAME = "INDEX_VERSION"
+WRITER_LOCK_FILENAME = "writer.lock"
+
+
+class IndexVersion:
+    """Index generation counter shared between processes through a small file.
+
+    The writer bumps the generation after every change to the store. Readers
+    poll the file (at most once per ``check_interval`` seconds, with a single
+    ``stat`` call) and reload when the generation moves.
+    """
+
+    def __init__(self, persist_directory: str, check_interval: float = 0.5):
+        self.path = os.path.join(persist_directory, VERSION_FILENAME)
+        self.check_interval = check_interval
+        self._last_check = 0.0
+        self._last_stat = None
+
+    def read(self) -> int:
+        """Return the current generation, 0 if nothing has been published yet."""
+        try:
+            with open(self.path) as f:
+                return int(json.load(f)["generation"])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def bump(self) -> int:
+        """Publish a new generation and return it."""
+        generation = self.read() + 1
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"generation": generation, "updated_at": time.time(), "pid": os.getpid()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Atomic rename, readers never see a partially written file
+        os.replace(tmp_path, self.path)
+        return generation
+
+    def poll(self) -> Optional[int]:
+        """Return the generation if the file may have changed since the last poll, else None."""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return None
+        self._last_check = now
+        try:
+            stat = os.stat(self.path)
+            current = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except OSError:
+            current = None
+        if current == self._last_stat:
+            return None
+        self._last_stat = current
+        return self.read()
+
+
+class WriterLock:
+    """Exclusive lock making sure only one process writes to a persist directory.
+
+    Uses ``fcntl.flock``, so the lock is released automatically if the writer
+    dies. On platforms without ``fcntl`` the lock is not enforced.
+    """
+
+    def __init__(self, persist_directory: str):
+        self.path = os.path.join(persist_directory, WRITER_LOCK_FILENAME)
+        self._file = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+")
+        if not FCNTL_AVAILABLE:
+            print("fcntl not available, the single-writer lock is not enforced on this platform")
+            return
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            raise RuntimeError(f"Another writer process already holds {self.path}")
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(os.getpid()))
+        self._file.flush()
+
+    def release(self):
+        if self._file is not None:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
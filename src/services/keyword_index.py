@@ -0,0 +1,135 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from collections import Counter
+import heapq
+import re
+import threading
+from langchain.schema import Document
+
+STOP_WORDS = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'can', 'what', 'how', 'when', 'where', 'why', 'who'}
+
+
+def extract_query_words(query: str) -> Set[str]:
+    """Extract meaningful keywords from a query."""
+    clean_query = re.sub(r'[^\w\s]', '', query.lower())  # Remove punctuation
+    return set(word for word in clean_query.split() if word not in STOP_WORDS and len(word) > 2)
+
+
+class KeywordIndex:
+    """In-memory inverted index over stored chunks for keyword search.
+
+    Replaces a full ``vectorstore.get()`` scan per query with posting-list
+    lookups. Matching and ranking are the same as the original scan: a chunk
+    matches on the number of distinct query keywords among its lowercased
+    whitespace tokens, ties keep insertion order.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chunks: Dict[str, Tuple[str, Dict[str, Any], int]] = {}  # id -> (text, metadata, seq)
+        self._postings: Dict[str, Set[str]] = {}  # word -> chunk ids
+        self._next_seq = 0
+
+    @classmethod
+    def from_store(cls, vectorstore) -> "KeywordIndex":
+        """Build the index from everything currently in a Chroma vector store."""
+        index = cls()
+        all_docs = vectorstore.get()
+        if all_docs and all_docs.get('documents'):
+            documents = all_docs['documents']
+            metadatas = all_docs.get('metadatas') or [{}] * len(documents)
+            index.add(all_docs['ids'], documents, metadatas)
+        return index
+
+    @classmethod
+    def from_postings(
+        cls,
+        ids: List[str],
+        texts: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        postings: Dict[str, List[int]]
+    ) -> "KeywordIndex":
+        """Rebuild an index from exported posting lists without re-tokenizing the chunks."""
+        index = cls()
+        for seq, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+            if text:
+                index._chunks[chunk_id] = (text, metadata or {}, seq)
+        index._next_seq = len(ids)
+        for word, positions in postings.items():
+            index._postings[word] = {ids[position] for position in positions}
+        return index
+
+    def export_postings(self, ids: List[str]) -> Dict[str, List[int]]:
+        """Export posting lists as positions into ``ids``."""
+        positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        with self._lock:
+            return {
+                word: sorted(positions[chunk_id] for chunk_id in posting if chunk_id in positions)
+                for word, posting in self._postings.items()
+            }
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def ids(self) -> Set[str]:
+        """Ids of the indexed chunks."""
+        with self._lock:
+            return set(self._chunks)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str], metadatas: Iterable[Optional[Dict[str, Any]]]):
+        """Add chunks to the index."""
+        with self._lock:
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                if not text:
+                    continue
+                if chunk_id in self._chunks:
+                    self._remove_locked(chunk_id)
+                self._chunks[chunk_id] = (text, metadata or {}, self._next_seq)
+                self._next_seq += 1
+                for word in set(word.lower() for word in text.split()):
+                    self._postings.setdefault(word, set()).add(chunk_id)
+
+    def remove(self, ids: Iterable[str]):
+        """Remove chunks from the index."""
+        with self._lock:
+            for chunk_id in ids:
+                self._remove_locked(chunk_id)
+
+    def _remove_locked(self, chunk_id: str):
+        entry = self._chunks.pop(chunk_id, None)
+        if entry is None:
+            return
+        for word in set(word.lower() for word in entry[0].split()):
+            posting = self._postings.get(word)
+            if posting is not None:
+                posting.discard(chunk_id)
+                if not posting:
+                    del self._postings[word]
+
+    def search(self, query: str, k: int = 3, sources: Optional[Set[str]] = None) -> List[Tuple[str, Document, int]]:
+        """Return up to k ``(chunk_id, document, overlap)`` matches, best first."""
+        query_words = extract_query_words(query)
+        if len(query_words) == 0:
+            return []  # No meaningful keywords
+
+        # More flexible matching: 1 match for short queries, 2 for longer ones
+        min_matches = 1 if len(query_words) <= 2 else min(2, len(query_words))
+
+        with self._lock:
+            overlaps = Counter()
+            for word in query_words:
+                overlaps.update(self._postings.get(word, ()))
+
+            candidates = []
+            for chunk_id, overlap in overlaps.items():
+                if overlap < min_matches:
+                    continue
+                text, metadata, seq = self._chunks[chunk_id]
+                if sources is not None and metadata.get("source") not in sources:
+                    continue
+                candidates.append((-overlap, seq, chunk_id))
+
+            top = heapq.nsmallest(k, candidates)
+            return [
+                (chunk_id, Document(page_content=self._chunks[chunk_id][0], metadata=dict(self._chunks[chunk_id][1])), -neg_overlap)
+                for neg_overlap, _, chunk_id in top
+            ]
@@ -0,0 +1,178 @@
+from typing import Any, Dict, List, Optional
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+import cProfile
+import hmac
+import random
+import threading
+import time
+import uuid
+
+# Profile of the request being handled in the current task, if it is profiled
+_current_session: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+
+# cProfile hooks the whole interpreter thread, so only one request gets function statistics at a time
+_cprofile_lock = threading.Lock()
+
+
+@contextmanager
+def stage(name: str):
+    """Record the wall and CPU time of a stage when the current request is profiled.
+
+    CPU time is measured for the calling thread, so it is exact for stages that
+    run without awaiting and includes other requests' work for stages that do.
+    """
+    session = _current_session.get()
+    if session is None:
+        yield
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        session.stages.append({
+            "name": name,
+            "offset": wall_start - session.wall_start,
+            "wall_time": time.perf_counter() - wall_start,
+            "cpu_time": time.thread_time() - cpu_start
+        })
+
+
+class ProfileSession:
+    """Timings collected while one request is profiled."""
+
+    def __init__(self, profile_id: str, kind: str, label: str):
+        self.id = profile_id
+        self.kind = kind
+        self.label = label
+        self.started_at = time.time()
+        self.wall_start = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+
+
+class Profiler:
+    """Opt-in per-request profiler keeping recent profiles in a bounded ring buffer.
+
+    A request is profiled when the client asks for it with ``token`` or when it
+    falls in the sampled fraction of traffic (``sample_rate``). Without a token,
+    clients cannot ask for profiles. Profiled requests record
+    per-stage wall and CPU times and, when no other request is being profiled,
+    cProfile function statistics for the thread the session runs on. A
+    session on an event loop (chat) reports ``"cprofile_event_loop"``: its
+    statistics miss the work handed to worker threads and include other
+    requests served by the loop meanwhile. A session on a worker thread
+    (upload) reports ``"cprofile"``.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 100,
+        sample_rate: float = 0.0,
+        top_functions: int = 50,
+        token: Optional[str] = None
+    ):
+        if capacity < 1:
+            raise ValueError("Profile buffer capacity must be at least 1")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("Profile sample rate must be between 0 and 1")
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self.top_functions = top_functions
+        self.token = token
+        self._profiles: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def accepts_token(self, token: Optional[str]) -> bool:
+        """Whether a client-supplied token allows it to ask for a profile."""
+        if not self.token or token is None:
+            return False
+        return hmac.compare_digest(token.strip().encode("utf-8"), self.token.encode("utf-8"))
+
+    def new_profile_id(self, requested: bool = False) -> Optional[str]:
+        """Decide whether to profile a request. Returns its profile id, or None."""
+        if requested or (self.sample_rate and random.random() < self.sample_rate):
+            return uuid.uuid4().hex[:16]
+        return None
+
+    @contextmanager
+    def session(self, profile_id: Optional[str], kind: str, label: str = ""):
+        """Profile the enclosed work under ``profile_id``; does nothing when it is None."""
+        if profile_id is None:
+            yield
+            return
+
+        session = ProfileSession(profile_id, kind, label)
+        token = _current_session.set(session)
+        profile = cProfile.Profile() if _cprofile_lock.acquire(blocking=False) else None
+        try:
+            asyncio.get_running_loop()
+            profiler = "cprofile_event_loop"
+        except RuntimeError:
+            profiler = "cprofile"
+        cpu_start = time.thread_time()
+        error = None
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+                _cprofile_lock.release()
+            cpu_time = time.thread_time() - cpu_start
+            wall_time = time.perf_counter() - session.wall_start
+            _current_session.reset(token)
+            self._store({
+                "id": session.id,
+                "kind": session.kind,
+                "label": session.label,
+                "started_at": session.started_at,
+                "wall_time": wall_time,
+                "cpu_time": cpu_time,
+                "profiler": profiler if profile is not None else "timings_only",
+                "error": error,
+                "stages": sorted(session.stages, key=lambda s: s["offset"]),
+                "functions": self._function_stats(profile) if profile is not None else []
+            })
+
+    def _function_stats(self, profile: cProfile.Profile) -> List[Dict[str, Any]]:
+        """Top functions by cumulative time."""
+        profile.create_stats()
+        rows = sorted(profile.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top_functions]
+        return [
+            {
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "primitive_calls": primitive_calls,
+                "total_time": total_time,
+                "cumulative_time": cumulative_time
+            }
+            for (filename, line, name), (primitive_calls, calls, total_time, cumulative_time, _) in rows
+        ]
+
+    def _store(self, record: Dict[str, Any]):
+        with self._lock:
+            self._profiles.append(record)
+
+    def list_profiles(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return stored profiles without function statistics, newest first."""
+        with self._lock:
+            records = list(self._profiles)
+        return [
+            {key: value for key, value in record.items() if key != "functions"}
+            for record in reversed(records)
+            if kind is None or record["kind"] == kind
+        ]
+
+    def get_profile(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for record in self._profiles:
+                if record["id"] == profile_id:
+                    return record
+        return None
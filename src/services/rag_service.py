@@ -1,27 +1,306 @@
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
+import asyncio
+import heapq
 import os
-from langchain_community.vectorstores import Chroma
+import sqlite3
+import threading
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
+from .dedup import DEDUP_OFF, DEDUP_SCOPES, DEDUP_SHARD, SIGNATURE_METADATA_KEY, NearDuplicateFilter, encode_signature
 from .embeddings import NomicEmbeddingsService
+from .index_version import ROLE_READER, ROLE_STANDALONE, ROLE_WRITER, ROLES, IndexVersion, WriterLock
+from .keyword_index import KeywordIndex
+from .profiling import Profiler, stage
+from .sharding import Shard, ShardRouter
+from .snapshot import IMPORT_BATCH_SIZE, Snapshot, read_collection, write_snapshot
 from ..utils.file_loader import FileLoader
 
+# Reciprocal rank fusion constant used to merge vector and keyword rankings
+RRF_K = 60
+
+# Candidates fetched from each ranking for /search; no page reaches beyond this depth
+SEARCH_DEPTH = 1000
+
+# Shallower fetch depths tried first, so early pages never pay for the full depth
+SEARCH_TIER_DEPTHS = (50, 200)
+
+# Fused /search rankings kept so later pages are sliced from the ranking earlier pages came from
+SEARCH_CACHE_SIZE = 256
+
+# Number of recent query embeddings kept in memory
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+# Deleted chunks that trigger a background compaction of the persisted store
+COMPACTION_MIN_DELETED = int(os.getenv("CHROMA_COMPACTION_MIN_DELETED", "500"))
+
+# Seconds between reader checks of the index version file
+INDEX_VERSION_CHECK_INTERVAL = float(os.getenv("INDEX_VERSION_CHECK_INTERVAL", "0.5"))
+
+
+class ReadOnlyError(RuntimeError):
+    """Raised when a reader process is asked to change the index."""
+
+
+class SearchRanking:
+    """A fused /search ranking, built one depth tier at a time.
+
+    Entries are only ever appended, so pages already served stay valid when a
+    deeper page extends the ranking. Instances are not modified once built.
+    """
+
+    def __init__(
+        self,
+        entries: Optional[List[Dict[str, Any]]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        tiers: int = 0,
+        complete: bool = False
+    ):
+        self.entries = entries or []
+        self.metadatas = metadatas or []  # stored chunk metadata, with the MinHash signature
+        self.tiers = tiers
+        self.complete = complete
+
+
+def _directory_size(path: str) -> int:
+    """Total size in bytes of the files under ``path``."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
 class RAGService:
-    def __init__(self):
+    def __init__(self, role: Optional[str] = None):
         self.embeddings = NomicEmbeddingsService()
         self.persist_directory = os.getenv("CHROMA_PERSIST_DIR", "./data/chroma")
-        self.vectorstore = Chroma(
-            persist_directory=self.persist_directory,
-            embedding_function=self.embeddings
+        
+        # standalone: one process does everything (default)
+        # writer: the only process allowed to change the index, publishes index generations
+        # reader: serves queries read-only and reloads when a new generation is published
+        self.role = role or os.getenv("RAG_ROLE", ROLE_STANDALONE)
+        if self.role not in ROLES:
+            raise ValueError(f"Invalid RAG_ROLE: {self.role}. Expected one of {', '.join(ROLES)}")
+        self.index_version = IndexVersion(self.persist_directory, check_interval=INDEX_VERSION_CHECK_INTERVAL)
+        self._writer_lock: Optional[WriterLock] = None
+        if self.role == ROLE_WRITER:
+            self._writer_lock = WriterLock(self.persist_directory)
+            self._writer_lock.acquire()
+        self.generation = self.index_version.read()
+        self._published_generation = self.generation
+        self._reload_lock = threading.Lock()
+        
+        # Near-duplicate handling: collapse at ingest within DEDUP_ON_INGEST scope, filter merged results at query time
+        self.dedup = NearDuplicateFilter(threshold=float(os.getenv("DEDUP_THRESHOLD", "0.8")))
+        self.dedup_on_ingest = os.getenv("DEDUP_ON_INGEST", "document")
+        if self.dedup_on_ingest not in DEDUP_SCOPES:
+            raise ValueError(f"Invalid DEDUP_ON_INGEST: {self.dedup_on_ingest}. Expected one of {', '.join(DEDUP_SCOPES)}")
+        self.dedup_on_query = os.getenv("DEDUP_ON_QUERY", "true").lower() in ("1", "true", "yes")
+        
+        # Opt-in request profiling (X-Profile header or a sampled fraction of traffic), kept in a ring buffer
+        self.profiler = Profiler(
+            capacity=int(os.getenv("PROFILE_BUFFER_SIZE", "100")),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            token=os.getenv("PROFILE_HEADER_TOKEN") or None
         )
+        
+        self.shards = self._open_shards()
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
         )
+        self._query_embedding_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._query_embedding_lock = threading.Lock()
+        self._search_cache: "OrderedDict[tuple, SearchRanking]" = OrderedDict()
+        self._search_cache_lock = threading.Lock()
+        # Bumped after every write by this process, so cached rankings never outlive the data they came from
+        self._index_epoch = 0
+        # Serializes writes to the store so compaction never races ingestion or deletes
+        self._write_lock = threading.Lock()
+        # Chunks deleted per collection since it was last rebuilt
+        self._deleted_since_compaction: Dict[str, int] = {}
+
+        # Bootstrap an empty replica from a snapshot instead of re-embedding every document
+        bootstrap_snapshot = os.getenv("CHROMA_BOOTSTRAP_SNAPSHOT")
+        if bootstrap_snapshot and not self.read_only and os.path.exists(bootstrap_snapshot) and self._is_empty():
+            manifest = self.import_snapshot(bootstrap_snapshot)
+            print(f"Bootstrapped vector store from {bootstrap_snapshot} ({manifest['count']} chunks)")
+
+    def _open_shards(self) -> ShardRouter:
+        return ShardRouter(
+            self.embeddings,
+            self.persist_directory,
+            num_shards=int(os.getenv("CHROMA_NUM_SHARDS", "1")),
+            read_only=self.read_only,
+            dedup=self.dedup
+        )
+
+    @property
+    def read_only(self) -> bool:
+        return self.role == ROLE_READER
+
+    @property
+    def vectorstore(self):
+        """The default collection, as used before sharding (None for a reader on an empty store)."""
+        shard = self.shards.default_shard
+        return shard.vectorstore if shard is not None else None
+
+    def _is_empty(self) -> bool:
+        return all(shard.count() == 0 for shard in self.shards.all_shards())
+
+    @contextmanager
+    def _writing(self, publish: bool = True):
+        """Hold the write lock for a change to the index, then publish a new generation.
 
-    async def process_document(self, content: bytes, filename: str):
-        """Process and store a document in the vector store."""
+        Writes can wait on compaction for a while, so never enter this on the event loop.
+        """
+        if self.read_only:
+            raise ReadOnlyError("This process serves queries read-only; send changes to the writer process")
+        with self._write_lock:
+            try:
+                yield
+            finally:
+                self._index_epoch += 1
+            if publish and self.role == ROLE_WRITER:
+                self.generation = self.index_version.bump()
+
+    def refresh_if_stale(self) -> bool:
+        """Start reloading the index in the background if the writer published a newer generation.
+
+        Requests keep being served from the current generation until the new one
+        is ready. Returns True if a reload was started. Costs at most one
+        ``stat`` call per check interval while nothing changes.
+        """
+        if not self.read_only:
+            return False
+        generation = self.index_version.poll()
+        if generation is not None:
+            self._published_generation = generation
+        if self._published_generation == self.generation:
+            return False
+        # Another thread is already reloading; it picks up newer generations before it finishes
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._reload, name="index-reload", daemon=True).start()
+        return True
+
+    def _reload(self):
+        """Open the latest published generation and swap it in. Runs on the reload thread."""
+        try:
+            self._reload_published()
+        except Exception as e:
+            print(f"Error reloading index: {e}")
+        finally:
+            self._reload_lock.release()
+
+    def _reload_published(self):
+        """Swap in generations until the latest published one is open. Caller holds the reload lock."""
+        while self._published_generation != self.generation:
+            generation = self._published_generation
+            previous = self.shards
+            previous.release_system()
+            shards = self._open_shards()
+            # Reuse the keyword and near-duplicate indexes, updated with the changed chunks only
+            shards.inherit_indexes(previous)
+            self.shards = shards
+            self.generation = generation
+            print(f"Reloaded index at generation {generation}")
+
+    def reload_now(self) -> bool:
+        """Reload synchronously if the writer published a newer generation. Returns True if one was opened.
+
+        Waits for a background reload that is already running instead of starting another.
+        """
+        if not self.read_only:
+            return False
+        generation = self.index_version.read()
+        if generation == self.generation:
+            return False
+        with self._reload_lock:
+            if generation > self._published_generation:
+                self._published_generation = generation
+            self._reload_published()
+        return True
+
+    def _embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing recent embeddings for repeated queries."""
+        with self._query_embedding_lock:
+            embedding = self._query_embedding_cache.get(query)
+            if embedding is not None:
+                self._query_embedding_cache.move_to_end(query)
+                return embedding
+        with stage("embed_query"):
+            embedding = self.embeddings.embed_query(query)
+        with self._query_embedding_lock:
+            self._query_embedding_cache[query] = embedding
+            if len(self._query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_embedding_cache.popitem(last=False)
+        return embedding
+
+    async def process_document(
+        self,
+        content: bytes,
+        filename: str,
+        namespace: Optional[str] = None,
+        profile_id: Optional[str] = None
+    ) -> int:
+        """Process and store a document in the vector store.
+
+        The document goes to its namespace's shard, or to a hash shard when no
+        namespace is given. When ``profile_id`` is set the upload is profiled
+        under that id. Returns the number of chunks stored.
+        """
+        def process() -> int:
+            with self.profiler.session(profile_id, "upload", filename):
+                with stage("prepare_documents"):
+                    documents = self._prepare_documents(content, filename)
+                with self._writing(), stage("store_chunks"):
+                    return self._add_documents(self.shards.shard_for_source(filename, namespace), documents)
+
+        # Extraction, embedding and the write lock all block, so keep them off the event loop
+        return await asyncio.to_thread(process)
+
+    async def replace_document(self, content: bytes, filename: str, namespace: Optional[str] = None) -> Tuple[int, int]:
+        """Replace every chunk of a document with a new version.
+
+        The new content is extracted and split before anything is deleted, so a
+        bad upload leaves the current version in place. Returns
+        ``(chunks_deleted, chunks_added)``.
+        """
+        def replace() -> Tuple[int, int]:
+            documents = self._prepare_documents(content, filename)
+            with self._writing():
+                deleted = self._delete_source(filename, namespace)
+                added = self._add_documents(self.shards.shard_for_source(filename, namespace), documents)
+            return deleted, added
+
+        return await asyncio.to_thread(replace)
+
+    async def delete_document(self, source: str, namespace: Optional[str] = None) -> int:
+        """Delete every chunk of a document. Returns the number of chunks deleted."""
+        def delete() -> int:
+            with self._writing():
+                return self._delete_source(source, namespace)
+
+        return await asyncio.to_thread(delete)
+
+    async def list_documents(self, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List stored documents with their chunk counts."""
+        counts: Dict[str, int] = {}
+        for shard in self.shards.shards_for_query(namespace):
+            for source, count in shard.source_counts().items():
+                counts[source] = counts.get(source, 0) + count
+        return [{"source": source, "chunk_count": count} for source, count in sorted(counts.items())]
+
+    def _prepare_documents(self, content: bytes, filename: str) -> List[Document]:
+        """Extract and split a file into chunk documents."""
         # Validate file type
         if not FileLoader.validate_file_type(filename):
             raise ValueError(f"Unsupported file type: {filename}")
@@ -33,80 +312,406 @@ class RAGService:
         chunks = self.text_splitter.split_text(text)
         
         # Create documents
-        documents = [
+        return [
             Document(page_content=chunk, metadata={"source": filename})
             for chunk in chunks
         ]
+
+    def _add_documents(self, shard: Shard, documents: List[Document]) -> int:
+        """Store chunk documents in a shard, collapsing near-duplicates. Caller holds the write lock.
+
+        Returns the number of chunks stored.
+        """
+        if not documents:
+            return 0
+        
+        if self.dedup_on_ingest != DEDUP_OFF:
+            existing = shard.lsh_index() if self.dedup_on_ingest == DEDUP_SHARD else None
+            keep, signatures = self.dedup.near_duplicate_mask([doc.page_content for doc in documents], existing)
+            if not all(keep):
+                print(f"Collapsed {keep.count(False)} near-duplicate chunks of {len(documents)} in {shard.name}")
+                documents = [doc for doc, kept in zip(documents, keep) if kept]
+                signatures = [signature for signature, kept in zip(signatures, keep) if kept]
+            if not documents:
+                return 0
+        else:
+            signatures = [self.dedup.hasher.signature(doc.page_content) for doc in documents]
+        
+        # Store the signatures with the chunks so query-time dedup and LSH index builds never re-hash them
+        for doc, signature in zip(documents, signatures):
+            doc.metadata[SIGNATURE_METADATA_KEY] = encode_signature(signature)
+        shard.add_documents(documents, signatures)
+        return len(documents)
+
+    def collapse_near_duplicates(self, documents: List[Document]) -> List[Document]:
+        """Drop retrieved chunks that are near-duplicates of a chunk ranked before them."""
+        if not self.dedup_on_query or len(documents) < 2:
+            return documents
+        keep, _ = self.dedup.near_duplicate_mask(
+            [doc.page_content for doc in documents], metadatas=[doc.metadata for doc in documents]
+        )
+        return [doc for doc, kept in zip(documents, keep) if kept]
+
+    def _delete_source(self, source: str, namespace: Optional[str] = None) -> int:
+        """Delete a document's chunks from every shard it may live in. Caller holds the write lock."""
+        deleted = 0
+        for shard in self.shards.shards_for_query(namespace):
+            removed = len(shard.delete_source(source))
+            if removed:
+                self._deleted_since_compaction[shard.name] = self._deleted_since_compaction.get(shard.name, 0) + removed
+                deleted += removed
+        return deleted
+
+    def compact(self, names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Drop deleted chunks from the vector indexes and reclaim their disk space.
+
+        Chroma only marks deleted vectors in its HNSW index, so the graph, its
+        files and the search cost stay as large as before the deletes. Each
+        collection is rebuilt from its live records and stored embeddings, then
+        Chroma's SQLite file is vacuumed. ``names`` limits the rebuild to those
+        collections; by default every collection is rebuilt. Blocks for the
+        duration, so call it off the event loop.
+
+        Readers may still be querying the collections a rebuild replaces, so
+        those are only dropped by the next compaction (or writer start), once
+        readers have moved to a later generation.
+        """
+        with self._writing():
+            for name in self.shards.drop_retired_collections():
+                print(f"Dropped {name}, replaced by the previous compaction")
+            shards = [shard for shard in self.shards.all_shards() if names is None or shard.name in names]
+            deleted_chunks = sum(self._deleted_since_compaction.get(shard.name, 0) for shard in shards)
+            if not shards:
+                return {"status": "skipped", "deleted_chunks": deleted_chunks, "rebuilt_collections": []}
+            
+            bytes_before = _directory_size(self.persist_directory)
+            for shard in shards:
+                self.shards.rebuild_shard(shard.name)
+                self._deleted_since_compaction.pop(shard.name, None)
+            
+            sqlite_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+            if os.path.exists(sqlite_path):
+                connection = sqlite3.connect(sqlite_path, timeout=30)
+                try:
+                    connection.execute("VACUUM")
+                finally:
+                    connection.close()
+            bytes_after = _directory_size(self.persist_directory)
         
-        # Add documents to vector store
-        self.vectorstore.add_documents(documents)
-        self.vectorstore.persist()
+        rebuilt = [shard.name for shard in shards]
+        print(f"Compacted {', '.join(rebuilt)}: {bytes_before} -> {bytes_after} bytes")
+        return {
+            "status": "compacted",
+            "deleted_chunks": deleted_chunks,
+            "rebuilt_collections": rebuilt,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after
+        }
+
+    def compact_if_needed(self, min_deleted: int = COMPACTION_MIN_DELETED) -> Optional[Dict[str, Any]]:
+        """Rebuild the collections with deletions once enough chunks have been deleted since the last run."""
+        if sum(self._deleted_since_compaction.values()) < min_deleted:
+            return None
+        try:
+            return self.compact([name for name, count in self._deleted_since_compaction.items() if count])
+        except Exception as e:
+            print(f"Error compacting vector store: {e}")
+            return None
+
+    def export_snapshot(self, path: str) -> Dict[str, Any]:
+        """Write every shard, with embeddings and keyword postings, to a snapshot file."""
+        with self._write_lock:
+            shards = []
+            for shard in self.shards.all_shards():
+                data = read_collection(shard.vectorstore._collection)
+                data["name"] = shard.name
+                # Record the parameters the index was built with, which the collection metadata may not match
+                data["metadata"] = {**(shard.vectorstore._collection.metadata or {}), **shard.config.collection_metadata()}
+                data["postings"] = shard.keyword_index().export_postings(data["ids"])
+                shards.append(data)
+            return write_snapshot(path, shards)
 
-    async def retrieve_relevant_chunks(self, query: str, k: int = 3) -> List[Document]:
+    def import_snapshot(self, path: str, replace: bool = False, reindex: bool = False) -> Dict[str, Any]:
+        """Load a snapshot file into the store without calling the embedding model.
+
+        Collections in the snapshot must be empty here unless ``replace`` is set,
+        in which case they are dropped and recreated first. Existing empty
+        collections are recreated too, so every imported collection is built
+        with the index parameters recorded in the snapshot, or with the
+        currently configured ones if ``reindex`` is set. Returns the snapshot
+        manifest.
+        """
+        with Snapshot(path) as snapshot, self._writing():
+            shards = snapshot.shards()
+            existing = set(self.shards._collection_names())
+            if not replace:
+                for data in shards:
+                    if data["ids"] and data["name"] in existing and self.shards._get_shard(data["name"]).count() > 0:
+                        raise ValueError(f"Collection {data['name']} is not empty, import with replace to overwrite it")
+            
+            for data in shards:
+                metadata = None if reindex else data["metadata"]
+                # e.g. the default collection, created empty with the configured parameters at startup
+                empty = data["name"] in existing and self.shards._get_shard(data["name"]).count() == 0
+                if replace or empty:
+                    shard = self.shards.reset_shard(data["name"], metadata)
+                else:
+                    shard = self.shards._get_shard(data["name"], metadata)
+                shard.add_embedded(data["ids"], data["documents"], data["metadatas"], data["embeddings"], IMPORT_BATCH_SIZE)
+                shard.set_keyword_index(KeywordIndex.from_postings(
+                    data["ids"], data["documents"], data["metadatas"], data["postings"]
+                ))
+            
+            manifest = snapshot.manifest
+            # Release the views into the mapped file before it is closed
+            shards = data = None
+        return manifest
+
+    async def retrieve_relevant_chunks(self, query: str, k: int = 3, namespace: Optional[str] = None) -> List[Document]:
         """Retrieve relevant document chunks for a query."""
-        docs_with_scores = await self.retrieve_relevant_chunks_with_scores(query, k)
+        docs_with_scores = await self.retrieve_relevant_chunks_with_scores(query, k, namespace)
         return [doc for doc, score in docs_with_scores]
     
-    async def retrieve_relevant_chunks_with_scores(self, query: str, k: int = 3) -> List[tuple]:
+    async def retrieve_relevant_chunks_with_scores(self, query: str, k: int = 3, namespace: Optional[str] = None) -> List[tuple]:
         """Retrieve relevant document chunks with their similarity scores."""
         try:
-            # Use similarity search with scores to filter low-relevance results
-            docs_with_scores = self.vectorstore.similarity_search_with_score(query, k=k*2)
-            
-            # Filter out results with very low similarity scores
-            # Chroma uses distance (lower is better), but we need stricter filtering
-            relevant_docs_with_scores = []
-            for doc, score in docs_with_scores:
-                # Balanced threshold - include relevant content
-                if score < 1.2:  # More inclusive threshold to capture PDF content
-                    relevant_docs_with_scores.append((doc, score))
-                    print(f"Vector search: score={score:.3f}, preview={doc.page_content[:100]}...")
-                    
-            return relevant_docs_with_scores[:k]  # Return top k relevant documents with scores
+            query_embedding = await asyncio.to_thread(self._embed_query, query)
+            relevant_docs_with_scores = (await self._vector_search([query_embedding], k, namespace))[0]
+            for doc, score in relevant_docs_with_scores:
+                print(f"Vector search: score={score:.3f}, preview={doc.page_content[:100]}...")
+            return relevant_docs_with_scores  # Return top k relevant documents with scores
         except Exception as e:
             print(f"Error in vector search: {e}")
-            # Fallback to regular similarity search
-            fallback_docs = self.vectorstore.similarity_search(query, k=k)
-            return [(doc, None) for doc in fallback_docs]  # Return with None scores
+            raise
+
+    async def retrieve_relevant_chunks_with_scores_batch(
+        self,
+        queries: List[str],
+        k: int = 3,
+        namespace: Optional[str] = None
+    ) -> List[List[tuple]]:
+        """Retrieve scored chunks for many queries with one embedding call and one vector query per shard."""
+        if not queries:
+            return []
+
+        # Embed every query in a single batched request instead of one call per question
+        query_embeddings = await asyncio.to_thread(
+            self.embeddings.embed, texts=queries, task_type="search_query"
+        )
+
+        # Chroma accepts many query vectors at once, so each shard sees a single multi-query search
+        return await self._vector_search(query_embeddings, k, namespace)
+
+    async def _vector_search(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        namespace: Optional[str] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[List[tuple]]:
+        """Fan a multi-query vector search out to the relevant shards in parallel.
+
+        Each shard fetches ``k`` times its candidate multiplier neighbours and
+        drops those beyond its relevance cutoff. Returns, per query, the global
+        top ``k`` ``(document, distance)`` pairs across shards, closest first.
+        """
+        shards = self.shards.shards_for_query(namespace)
+        if not shards:
+            return [[] for _ in query_embeddings]
+
+        def search_shard(shard: Shard) -> List[List[tuple]]:
+            # Fetch extra candidates so low-relevance results can be filtered out
+            with stage(f"vector_search:{shard.name}"):
+                results = shard.query(query_embeddings, k * shard.config.candidate_multiplier, where)
+            return [self._filter_by_distance(docs_with_scores, shard.config.max_distance) for docs_with_scores in results]
+
+        try:
+            shard_results = await asyncio.gather(*(asyncio.to_thread(search_shard, shard) for shard in shards))
+        except Exception:
+            # A compaction may have dropped a collection this reader's generation still uses
+            if not await asyncio.to_thread(self.reload_now):
+                raise
+            print("Retrying vector search on the latest index generation")
+            return await self._vector_search(query_embeddings, k, namespace, where)
+
+        # Every shard returns its results sorted by distance, so a heap merge gives the global top-k
+        return [
+            list(islice(heapq.merge(*(results[i] for results in shard_results), key=lambda pair: pair[1]), k))
+            for i in range(len(query_embeddings))
+        ]
+
+    @staticmethod
+    def _filter_by_distance(docs_with_scores: List[tuple], max_distance: float) -> List[tuple]:
+        """Drop low-relevance results."""
+        # Chroma uses distance (lower is better), so results beyond the cutoff are not relevant
+        return [(doc, score) for doc, score in docs_with_scores if score < max_distance]
+
+    def _keyword_search(
+        self,
+        query: str,
+        k: int,
+        namespace: Optional[str] = None,
+        sources: Optional[List[str]] = None
+    ) -> List[tuple]:
+        """Keyword search over the relevant shards, merged into a global top k of ``(id, document, overlap)``."""
+        source_filter = set(sources) if sources else None
+        with stage("keyword_search"):
+            per_shard = [
+                shard.keyword_index().search(query, k, sources=source_filter)
+                for shard in self.shards.shards_for_query(namespace)
+            ]
+            return list(islice(heapq.merge(*per_shard, key=lambda match: -match[2]), k))
 
-    async def keyword_search(self, query: str, k: int = 3) -> List[Document]:
+    async def keyword_search(self, query: str, k: int = 3, namespace: Optional[str] = None) -> List[Document]:
         """Perform keyword-based search as a fallback."""
         try:
-            # Get all documents from the vector store
-            all_docs = self.vectorstore.get()
-            
-            if not all_docs or not all_docs.get('documents'):
-                return []
-            
-            # Extract query keywords (better preprocessing)
-            import re
-            clean_query = re.sub(r'[^\w\s]', '', query.lower())  # Remove punctuation
-            stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'can', 'what', 'how', 'when', 'where', 'why', 'who'}
-            query_words = set(word for word in clean_query.split() if word not in stop_words and len(word) > 2)
-            
-            if len(query_words) == 0:
-                return []  # No meaningful keywords
-            
-            # Score documents based on keyword matches
-            scored_docs = []
-            documents = all_docs['documents']
-            metadatas = all_docs.get('metadatas', [{}] * len(documents))
-            
-            for i, doc_text in enumerate(documents):
-                if doc_text:
-                    doc_words = set(word.lower() for word in doc_text.split())
-                    # Calculate keyword overlap score
-                    overlap = len(query_words.intersection(doc_words))
-                    # More flexible matching: 1 match for short queries, 2 for longer ones
-                    min_matches = 1 if len(query_words) <= 2 else min(2, len(query_words))
-                    if overlap >= min_matches:
-                        metadata = metadatas[i] if i < len(metadatas) else {}
-                        scored_docs.append((overlap, Document(page_content=doc_text, metadata=metadata)))
-            
-            # Sort by score (descending) and return top k
-            scored_docs.sort(key=lambda x: x[0], reverse=True)
-            return [doc for _, doc in scored_docs[:k]]
-            
+            return [doc for _, doc, _ in self._keyword_search(query, k, namespace)]
         except Exception as e:
             print(f"Error in keyword search: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    async def keyword_search_batch(self, queries: List[str], k: int = 3, namespace: Optional[str] = None) -> List[List[Document]]:
+        """Perform keyword search for many queries against the shared keyword indexes."""
+        try:
+            return [[doc for _, doc, _ in self._keyword_search(query, k, namespace)] for query in queries]
+        except Exception as e:
+            print(f"Error in keyword search: {e}")
+            return [[] for _ in queries]
+
+    async def search(
+        self,
+        query: str,
+        k: int = 10,
+        offset: int = 0,
+        sources: Optional[List[str]] = None,
+        namespace: Optional[str] = None,
+        depth: int = SEARCH_DEPTH
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """Hybrid retrieval without generation, for search-style callers.
+
+        Runs vector and keyword search, merges them with reciprocal rank fusion
+        and returns the ``offset``..``offset + k`` slice of the ranking together
+        with a flag telling whether more results follow.
+
+        The ranking is built in tiers of growing fetch depth (``SEARCH_TIER_DEPTHS``,
+        then ``depth``). A shallower tier contributes the first half of its
+        fused ranking, and each deeper tier only appends entries after it, so
+        the first pages stay cheap while every page is still a slice of one
+        stable ranking. Rankings are cached per search and index state, so
+        later pages reuse the tiers earlier pages fetched.
+        """
+        if offset + k > depth:
+            raise ValueError(f"Cannot page beyond {depth} results")
+        where = None
+        if sources:
+            where = {"source": sources[0]} if len(sources) == 1 else {"source": {"$in": list(sources)}}
+
+        key = (self.generation, self._index_epoch, query, tuple(sorted(sources or [])), namespace, depth)
+        with self._search_cache_lock:
+            ranking = self._search_cache.get(key)
+            if ranking is not None:
+                self._search_cache.move_to_end(key)
+        ranking = ranking or SearchRanking()
+        tiers = [tier for tier in SEARCH_TIER_DEPTHS if tier < depth] + [depth]
+
+        extended = False
+        while len(ranking.entries) <= offset + k and not ranking.complete:
+            tier_depth = tiers[ranking.tiers]
+
+            async def vector_search() -> List[tuple]:
+                embedding = await asyncio.to_thread(self._embed_query, query)
+                return (await self._vector_search([embedding], tier_depth, namespace, where))[0]
+
+            vector_results, keyword_results = await asyncio.gather(
+                vector_search(),
+                asyncio.to_thread(self._keyword_search, query, tier_depth, namespace, sources)
+            )
+            # Fusing and collapsing a deep candidate pool is CPU work, keep it off the event loop
+            ranking = await asyncio.to_thread(
+                self._extend_ranking, ranking, vector_results, keyword_results, tier_depth, ranking.tiers + 1 == len(tiers)
+            )
+            extended = True
+
+        if extended:
+            with self._search_cache_lock:
+                self._search_cache[key] = ranking
+                self._search_cache.move_to_end(key)
+                if len(self._search_cache) > SEARCH_CACHE_SIZE:
+                    self._search_cache.popitem(last=False)
+        return ranking.entries[offset:offset + k], len(ranking.entries) > offset + k
+
+    def _extend_ranking(
+        self,
+        ranking: SearchRanking,
+        vector_results: List[tuple],
+        keyword_results: List[tuple],
+        tier_depth: int,
+        last: bool
+    ) -> SearchRanking:
+        """Append one tier's fused ranking to ``ranking``, skipping entries it already holds."""
+        # Fewer candidates than requested means a deeper fetch would not find more
+        complete = last or (len(vector_results) < tier_depth and len(keyword_results) < tier_depth)
+        limit = None if complete else tier_depth // 2
+
+        entries = list(ranking.entries)
+        metadatas = list(ranking.metadatas)
+        contents = {entry["content"] for entry in entries}
+        seen = self.dedup.new_index()
+        if self.dedup_on_query:
+            for i, (entry, metadata) in enumerate(zip(entries, metadatas)):
+                seen.add(str(i), self.dedup.signature(entry["content"], metadata))
+
+        for entry, metadata in self._fuse_rankings(vector_results, keyword_results):
+            if limit is not None and len(entries) >= limit:
+                break
+            if entry["content"] in contents:
+                continue
+            if self.dedup_on_query:
+                signature = self.dedup.signature(entry["content"], metadata)
+                if seen.query(signature) is not None:
+                    continue
+                seen.add(str(len(entries)), signature)
+            entries.append(entry)
+            metadatas.append(metadata)
+            contents.add(entry["content"])
+        return SearchRanking(entries, metadatas, ranking.tiers + 1, complete)
+
+    def _fuse_rankings(self, vector_results: List[tuple], keyword_results: List[tuple]) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Merge vector and keyword rankings with reciprocal rank fusion, collapsing near-duplicates.
+
+        Returns ``(entry, metadata)`` pairs, best first, where ``metadata`` is the stored chunk metadata.
+        """
+        # Merge both rankings, deduplicating on chunk content like the chat workflow does
+        merged: Dict[str, Dict[str, Any]] = {}
+        metadatas: Dict[str, Dict[str, Any]] = {}
+        for rank, (doc, distance) in enumerate(vector_results):
+            entry = merged.setdefault(doc.page_content, self._search_entry(doc))
+            metadatas.setdefault(doc.page_content, doc.metadata)
+            entry["vector_distance"] = distance
+            entry["score"] += 1.0 / (RRF_K + rank + 1)
+        for rank, (_, doc, overlap) in enumerate(keyword_results):
+            entry = merged.setdefault(doc.page_content, self._search_entry(doc))
+            metadatas.setdefault(doc.page_content, doc.metadata)
+            entry["keyword_score"] = overlap
+            entry["score"] += 1.0 / (RRF_K + rank + 1)
+
+        ranked = sorted(merged.values(), key=lambda entry: entry["score"], reverse=True)
+        if self.dedup_on_query and len(ranked) > 1:
+            keep, _ = self.dedup.near_duplicate_mask(
+                [entry["content"] for entry in ranked],
+                metadatas=[metadatas[entry["content"]] for entry in ranked]
+            )
+            ranked = [entry for entry, kept in zip(ranked, keep) if kept]
+        return [(entry, metadatas[entry["content"]]) for entry in ranked]
+
+    @staticmethod
+    def _search_entry(doc: Document) -> Dict[str, Any]:
+        return {
+            "source": doc.metadata.get("source", "unknown_source"),
+            "content": doc.page_content,
+            # The stored MinHash signature is internal to deduplication
+            "metadata": {key: value for key, value in doc.metadata.items() if key != SIGNATURE_METADATA_KEY},
+            "score": 0.0,
+            "vector_distance": None,
+            "keyword_score": None
+        }
\ No newline at end of file
@@ -0,0 +1,502 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+import re
+import threading
+import zlib
+import chromadb
+from chromadb.types import SegmentScope
+from langchain_community.vectorstores import Chroma
+from langchain.schema import Document
+from .dedup import SIGNATURE_METADATA_KEY, LSHIndex, NearDuplicateFilter, encode_signature
+from .index_config import IndexConfig
+from .keyword_index import KeywordIndex
+from .snapshot import IMPORT_BATCH_SIZE, read_collection
+
+# Collection used by the unsharded service; it stays hash shard 0 so existing data keeps being served
+DEFAULT_COLLECTION = "langchain"
+
+# Hash shards beyond the first are named "langchain_shard_<i>"
+HASH_SHARD_PATTERN = re.compile(rf"^{DEFAULT_COLLECTION}_shard_(\d+)$")
+
+# Prefix for collections that hold one namespace (tenant) each
+NAMESPACE_PREFIX = "ns_"
+
+# Prefixes for the collections a rebuild writes into and retires; they never clash with "langchain" or "ns_"
+REBUILD_PREFIX = "rebuild_"
+RETIRED_PREFIX = "retired_"
+
+# Chroma collection names are limited to 63 characters of [A-Za-z0-9._-]
+NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,46}[A-Za-z0-9])?$")
+
+
+def validate_namespace(namespace: str) -> str:
+    """Return the namespace if it can be used as part of a collection name."""
+    if not NAMESPACE_PATTERN.match(namespace):
+        raise ValueError(
+            f"Invalid namespace: {namespace!r}. Use 1-48 letters, digits, '_' or '-', "
+            "starting and ending with a letter or digit."
+        )
+    return namespace
+
+
+class Shard:
+    """One Chroma collection plus the in-memory indexes derived from it."""
+
+    def __init__(
+        self,
+        name: str,
+        vectorstore: Chroma,
+        dedup: Optional[NearDuplicateFilter] = None,
+        config: Optional[IndexConfig] = None
+    ):
+        self.name = name
+        self.vectorstore = vectorstore
+        self.dedup = dedup
+        self.config = config or IndexConfig().with_collection_metadata(vectorstore._collection.metadata)
+        self._keyword_index: Optional[KeywordIndex] = None
+        self._keyword_index_lock = threading.Lock()
+        self._lsh_index: Optional[LSHIndex] = None
+        self._lsh_index_lock = threading.Lock()
+
+    def keyword_index(self) -> KeywordIndex:
+        """Return the keyword index, building it from the collection on first use."""
+        if self._keyword_index is None:
+            with self._keyword_index_lock:
+                if self._keyword_index is None:
+                    self._keyword_index = KeywordIndex.from_store(self.vectorstore)
+        return self._keyword_index
+
+    def lsh_index(self) -> LSHIndex:
+        """Return the near-duplicate LSH index, building it from the collection on first use."""
+        if self.dedup is None:
+            raise RuntimeError("Near-duplicate detection is not configured for this shard")
+        if self._lsh_index is None:
+            with self._lsh_index_lock:
+                if self._lsh_index is None:
+                    self._lsh_index = self._build_lsh_index()
+        return self._lsh_index
+
+    def _build_lsh_index(self) -> LSHIndex:
+        """Index the signatures stored with the chunks, hashing only chunks stored without one."""
+        index = self.dedup.new_index()
+        all_docs = self.vectorstore.get(include=["metadatas"])
+        unsigned = []
+        for chunk_id, metadata in zip(all_docs["ids"], all_docs["metadatas"]):
+            signature = self.dedup.stored_signature(metadata)
+            if signature is None:
+                unsigned.append(chunk_id)
+            else:
+                index.add(chunk_id, signature)
+        if unsigned:
+            legacy = self.vectorstore.get(ids=unsigned, include=["documents"])
+            for chunk_id, text in zip(legacy["ids"], legacy["documents"]):
+                if text:
+                    index.add(chunk_id, self.dedup.hasher.signature(text))
+        return index
+
+    def set_keyword_index(self, keyword_index: KeywordIndex):
+        """Install a prebuilt keyword index, e.g. one loaded from a snapshot."""
+        with self._keyword_index_lock:
+            self._keyword_index = keyword_index
+
+    def add_documents(self, documents: List[Document], signatures: Optional[List[Any]] = None) -> List[str]:
+        """Store chunk documents and update derived indexes.
+
+        ``signatures`` are the chunks' MinHash signatures when already computed.
+        """
+        ids = self.vectorstore.add_documents(documents)
+        self.vectorstore.persist()
+
+        # Keep the derived indexes in sync (they are built lazily on first use)
+        if self._keyword_index is not None:
+            self._keyword_index.add(ids, [doc.page_content for doc in documents], [doc.metadata for doc in documents])
+        if self._lsh_index is not None:
+            if signatures is None:
+                signatures = [self.dedup.signature(doc.page_content, doc.metadata) for doc in documents]
+            for chunk_id, signature in zip(ids, signatures):
+                self._lsh_index.add(chunk_id, signature)
+        return ids
+
+    def add_embedded(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Optional[Dict[str, Any]]],
+        embeddings: Any,
+        batch_size: int = 1000
+    ):
+        """Store chunks whose embeddings are already known, without calling the embedding model."""
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            self.vectorstore._collection.add(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+                embeddings=embeddings[start:end].tolist()
+            )
+        # The derived indexes no longer match the collection, rebuild them on next use
+        with self._keyword_index_lock:
+            self._keyword_index = None
+        with self._lsh_index_lock:
+            self._lsh_index = None
+
+    def adopt_indexes(self, other: "Shard"):
+        """Take over another shard's derived indexes; both must hold the same chunks."""
+        with self._keyword_index_lock:
+            self._keyword_index = other._keyword_index
+        with self._lsh_index_lock:
+            self._lsh_index = other._lsh_index
+
+    def sync_indexes(self):
+        """Bring adopted derived indexes up to date with the collection.
+
+        Only the collection's ids are read; chunks added since the indexes were
+        built are fetched and indexed, and removed ones are dropped, instead of
+        rebuilding from a full scan.
+        """
+        keyword_index = self._keyword_index
+        lsh_index = self._lsh_index
+        if keyword_index is None and lsh_index is None:
+            return
+
+        current = set(self.vectorstore.get(include=[])["ids"])
+        keyword_missing: Set[str] = set()
+        lsh_missing: Set[str] = set()
+        if keyword_index is not None:
+            known = keyword_index.ids()
+            keyword_index.remove(known - current)
+            keyword_missing = current - known
+        if lsh_index is not None:
+            known = lsh_index.keys()
+            lsh_index.remove(known - current)
+            lsh_missing = current - known
+
+        added_ids = sorted(keyword_missing | lsh_missing)
+        if not added_ids:
+            return
+        added = self.vectorstore.get(ids=added_ids, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(added["ids"], added["documents"], added["metadatas"]):
+            if chunk_id in keyword_missing:
+                keyword_index.add([chunk_id], [text], [metadata])
+            if chunk_id in lsh_missing and text:
+                lsh_index.add(chunk_id, self.dedup.signature(text, metadata))
+
+    def count(self) -> int:
+        return self.vectorstore._collection.count()
+
+    def delete_source(self, source: str) -> List[str]:
+        """Delete a document's chunks from the collection and derived indexes. Returns the deleted ids."""
+        ids = self.vectorstore.get(where={"source": source}, include=[])["ids"]
+        if not ids:
+            return []
+
+        self.vectorstore.delete(ids=ids)
+        self.vectorstore.persist()
+
+        if self._keyword_index is not None:
+            self._keyword_index.remove(ids)
+        if self._lsh_index is not None:
+            self._lsh_index.remove(ids)
+        return ids
+
+    def source_counts(self) -> Dict[str, int]:
+        """Count stored chunks per source."""
+        all_docs = self.vectorstore.get(include=["metadatas"])
+        counts: Dict[str, int] = {}
+        for metadata in all_docs.get("metadatas") or []:
+            source = (metadata or {}).get("source", "unknown_source")
+            counts[source] = counts.get(source, 0) + 1
+        return counts
+
+    def query(self, query_embeddings: List[List[float]], n_results: int, where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[Document, float]]]:
+        """Run a multi-query vector search. Returns ``(document, distance)`` lists, one per query."""
+        results = self.vectorstore._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            [
+                (Document(page_content=text, metadata=metadata or {}), distance)
+                for text, metadata, distance in zip(
+                    results["documents"][i], results["metadatas"][i], results["distances"][i]
+                )
+            ]
+            for i in range(len(query_embeddings))
+        ]
+
+
+class ShardRouter:
+    """Maps documents and queries onto sharded Chroma collections.
+
+    Documents uploaded with a namespace (tenant) go to that namespace's own
+    collection, and queries scoped to a namespace only touch it. Everything
+    else is spread over ``num_shards`` hash shards keyed on the source name;
+    unscoped queries fan out over all of them.
+
+    A ``read_only`` router never creates collections: it only opens the ones
+    that existed when it was constructed.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        persist_directory: str,
+        num_shards: int = 1,
+        read_only: bool = False,
+        dedup: Optional[NearDuplicateFilter] = None
+    ):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.embeddings = embeddings
+        self.persist_directory = persist_directory
+        self.num_shards = num_shards
+        self.read_only = read_only
+        self.dedup = dedup
+        self._lock = threading.Lock()
+
+        # Reject bad per-collection settings now rather than when a collection is first opened.
+        # Unscoped queries merge the hash shards' raw distances, so they all keep the configured metric.
+        for name in IndexConfig.collection_overrides():
+            IndexConfig.from_env(name, shared_space=self._is_hash_shard(name))
+
+        self._client = chromadb.PersistentClient(path=persist_directory)
+        self._shards: Dict[str, Shard] = {}
+        # Readers see a fixed set of collections until they are reloaded
+        self._known_collections = set(self._list_collections()) if read_only else None
+        self.hash_shard_names = [DEFAULT_COLLECTION] + [
+            f"{DEFAULT_COLLECTION}_shard_{i}" for i in range(1, num_shards)
+        ]
+        # Hash shards left over from a larger num_shards: still searched, but no longer written to
+        self.extra_hash_shard_names: List[str] = []
+        for name in self._collection_names():
+            self._track_hash_shard(name)
+        # Readers reopen the router on every index generation, so only the writer warns
+        if self.extra_hash_shard_names and not read_only:
+            print(
+                f"Store has {len(self.extra_hash_shard_names)} hash shards beyond CHROMA_NUM_SHARDS={num_shards} "
+                f"({', '.join(self.extra_hash_shard_names)}); their documents stay searchable and deletable, "
+                "but re-upload them to move them onto the configured shards"
+            )
+        if not read_only:
+            self._recover_rebuilds()
+            self._get_shard(DEFAULT_COLLECTION)
+
+    def _list_collections(self) -> List[str]:
+        return [getattr(collection, "name", collection) for collection in self._client.list_collections()]
+
+    def _collection_names(self) -> List[str]:
+        if self._known_collections is not None:
+            return list(self._known_collections)
+        return self._list_collections()
+
+    @staticmethod
+    def _is_hash_shard(name: str) -> bool:
+        return name == DEFAULT_COLLECTION or HASH_SHARD_PATTERN.match(name) is not None
+
+    def _track_hash_shard(self, name: str):
+        """Remember a hash shard collection outside the configured range."""
+        match = HASH_SHARD_PATTERN.match(name)
+        if match and name not in self.hash_shard_names and name not in self.extra_hash_shard_names:
+            self.extra_hash_shard_names.append(name)
+            self.extra_hash_shard_names.sort(key=lambda shard_name: int(HASH_SHARD_PATTERN.match(shard_name).group(1)))
+
+    @property
+    def default_shard(self) -> Optional[Shard]:
+        return self._get_shard(DEFAULT_COLLECTION)
+
+    def _get_shard(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[Shard]:
+        """Return a shard by collection name, opening (or creating) it on first use.
+
+        Read-only routers return None for collections that do not exist.
+        """
+        shard = self._shards.get(name)
+        if shard is None:
+            if self._known_collections is not None and name not in self._known_collections:
+                return None
+            with self._lock:
+                shard = self._shards.get(name)
+                if shard is None:
+                    shard = self._open_shard(name, metadata)
+                    self._shards[name] = shard
+                    # e.g. a snapshot taken with more hash shards than configured here
+                    self._track_hash_shard(name)
+        return shard
+
+    def _open_shard(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> Shard:
+        """Open a collection, creating it with ``metadata`` or the configured index parameters.
+
+        Metadata is only passed when the collection is created. Chroma builds the
+        HNSW index from it then and never changes the index afterwards, so the
+        shard's config is read back from the index rather than from the settings.
+        """
+        config = IndexConfig.from_env(name, shared_space=self._is_hash_shard(name))
+        if name not in self._list_collections():
+            self._client.create_collection(
+                name, metadata=metadata or config.collection_metadata(), embedding_function=None
+            )
+        vectorstore = Chroma(
+            client=self._client,
+            collection_name=name,
+            persist_directory=self.persist_directory,
+            embedding_function=self.embeddings
+        )
+        index_metadata = self._index_metadata(vectorstore._collection)
+        return Shard(name, vectorstore, self.dedup, config.with_collection_metadata(index_metadata))
+
+    def _index_metadata(self, collection) -> Optional[Dict[str, Any]]:
+        """The ``hnsw:*`` parameters a collection's vector index was built with.
+
+        Chroma copies them into the vector segment when the collection is
+        created. The collection's own metadata can be changed afterwards without
+        affecting the index, so it is only used when the segment is unavailable.
+        """
+        try:
+            segments = self._client._server._sysdb.get_segments(collection=collection.id, scope=SegmentScope.VECTOR)
+        except Exception as e:
+            print(f"Could not read index parameters of {collection.name}, using its metadata: {e}")
+            return collection.metadata
+        if not segments:
+            return collection.metadata
+        return segments[0]["metadata"] or {}
+
+    def _require_writable(self):
+        if self.read_only:
+            raise RuntimeError("Shard router is read-only")
+
+    def reset_shard(self, name: str, metadata: Optional[Dict[str, Any]] = None) -> Shard:
+        """Drop a collection and recreate it empty, with ``metadata`` or the configured index parameters."""
+        self._require_writable()
+        with self._lock:
+            if name in self._list_collections():
+                self._client.delete_collection(name)
+            self._shards.pop(name, None)
+            shard = self._open_shard(name, metadata)
+            self._shards[name] = shard
+            # e.g. a snapshot imported with --replace that has more hash shards than configured here
+            self._track_hash_shard(name)
+        return shard
+
+    def rebuild_shard(self, name: str) -> Shard:
+        """Rebuild a collection from its live records and stored embeddings.
+
+        Chroma only marks deleted vectors in the HNSW graph, so the index keeps
+        their nodes and files. The live records are copied into a new collection
+        with the same index parameters, which then takes over the name. No
+        embedding calls are made.
+
+        The old collection is renamed with ``RETIRED_PREFIX`` and kept, because
+        readers go on querying it until they reload the next index generation.
+        ``drop_retired_collections`` removes it, with its index files and
+        write-ahead log, later.
+        """
+        self._require_writable()
+        shard = self._get_shard(name)
+        data = read_collection(shard.vectorstore._collection)
+        rebuild_name = REBUILD_PREFIX + name
+        retired_name = RETIRED_PREFIX + name
+        existing = self._list_collections()
+        for leftover in (rebuild_name, retired_name):
+            if leftover in existing:
+                self._client.delete_collection(leftover)
+
+        if self.dedup is not None:
+            # Chunks stored before signatures were kept in metadata get theirs now
+            for i, (text, metadata) in enumerate(zip(data["documents"], data["metadatas"])):
+                if text and self.dedup.stored_signature(metadata) is None:
+                    signature = encode_signature(self.dedup.hasher.signature(text))
+                    data["metadatas"][i] = {**(metadata or {}), SIGNATURE_METADATA_KEY: signature}
+
+        rebuilt = self._open_shard(rebuild_name, shard.config.collection_metadata())
+        rebuilt.add_embedded(data["ids"], data["documents"], data["metadatas"], data["embeddings"], IMPORT_BATCH_SIZE)
+
+        with self._lock:
+            # Rename rather than delete first, so searches already running on the old collection still finish
+            shard.vectorstore._collection.modify(name=retired_name)
+            rebuilt.vectorstore._collection.modify(name=name)
+            replacement = self._open_shard(name)
+            replacement.adopt_indexes(shard)
+            self._shards[name] = replacement
+        return replacement
+
+    def drop_retired_collections(self) -> List[str]:
+        """Drop the collections replaced by earlier rebuilds. Returns their names."""
+        self._require_writable()
+        retired = sorted(name for name in self._list_collections() if name.startswith(RETIRED_PREFIX))
+        for name in retired:
+            self._client.delete_collection(name)
+        return retired
+
+    def _recover_rebuilds(self):
+        """Finish or roll back collection rebuilds interrupted by a crash."""
+        existing = set(self._list_collections())
+        for collection in sorted(existing):
+            for prefix in (REBUILD_PREFIX, RETIRED_PREFIX):
+                if not collection.startswith(prefix):
+                    continue
+                name = collection[len(prefix):]
+                if name in existing:
+                    self._client.delete_collection(collection)
+                else:
+                    # A rebuilt collection is complete before the original is retired, so either one holds every chunk
+                    self._client.get_collection(collection, embedding_function=None).modify(name=name)
+                    existing.add(name)
+                    print(f"Restored collection {name} from interrupted rebuild ({collection})")
+                existing.discard(collection)
+
+    def shard_for_source(self, source: str, namespace: Optional[str] = None) -> Shard:
+        """Pick the shard a document is stored in."""
+        self._require_writable()
+        if namespace:
+            return self._get_shard(NAMESPACE_PREFIX + validate_namespace(namespace))
+        index = zlib.crc32(source.encode("utf-8")) % self.num_shards
+        return self._get_shard(self.hash_shard_names[index])
+
+    def shards_for_query(self, namespace: Optional[str] = None) -> List[Shard]:
+        """Pick the shards a query (or source lookup) has to visit."""
+        if namespace:
+            name = NAMESPACE_PREFIX + validate_namespace(namespace)
+            if name not in self._shards and name not in self._collection_names():
+                return []  # Unknown namespace, nothing to search
+            names = [name]
+        else:
+            # Hash routing changes with num_shards, so lookups visit every hash shard in the store
+            names = self.hash_shard_names + self.extra_hash_shard_names
+        return [shard for shard in (self._get_shard(name) for name in names) if shard is not None]
+
+    def namespace_collections(self) -> List[str]:
+        """List the namespace collections present in the store."""
+        return sorted(name for name in self._collection_names() if name.startswith(NAMESPACE_PREFIX))
+
+    def namespaces(self) -> List[str]:
+        """List the namespaces present in the store."""
+        return [name[len(NAMESPACE_PREFIX):] for name in self.namespace_collections()]
+
+    def all_shards(self) -> List[Shard]:
+        """Return every hash shard and namespace shard in the store."""
+        names = self.hash_shard_names + self.extra_hash_shard_names + self.namespace_collections()
+        shards = (self._get_shard(name) for name in names)
+        return [shard for shard in shards if shard is not None]
+
+    def inherit_indexes(self, previous: "ShardRouter"):
+        """Carry derived indexes over from the router of the previous index generation.
+
+        Indexes are updated with the changed chunks only; shards without a
+        previous keyword index build one now, so no query has to.
+        """
+        for shard in self.all_shards():
+            previous_shard = previous._shards.get(shard.name)
+            if previous_shard is not None:
+                shard.adopt_indexes(previous_shard)
+                shard.sync_indexes()
+            shard.keyword_index()
+
+    def release_system(self):
+        """Drop Chroma's cached system for this store so the next router reopens it from disk.
+
+        This router keeps the system it already holds, so it can go on serving
+        searches until the next router is ready.
+        """
+        clear_system_cache = getattr(self._client, "clear_system_cache", None)
+        if clear_system_cache is not None:
+            clear_system_cache()
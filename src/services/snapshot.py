@@ -0,0 +1,233 @@
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+# Snapshot layout:
+#   magic (8 bytes) | format version (uint32) | reserved (uint32) | manifest length (uint64)
+#   manifest (UTF-8 JSON) | zero padding to a 64-byte boundary
+#   payload: float32 embedding matrix (row-major, one row per chunk, 64-byte aligned)
+#            | zlib-compressed JSON records | zlib-compressed JSON keyword postings
+# The manifest records every payload section's offset and size and the SHA-256 of the payload.
+SNAPSHOT_MAGIC = b"RAGSNAP\x00"
+SNAPSHOT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sIIQ")
+_ALIGNMENT = 64
+
+# Chunks read from (and written to) Chroma per call
+EXPORT_PAGE_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is malformed, corrupted or of an unsupported version."""
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def write_snapshot(path: str, shards: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Write shards to a snapshot file and return its manifest.
+
+    Each shard is a dict with ``name``, ``metadata`` (collection metadata),
+    ``ids``, ``documents``, ``metadatas``, ``embeddings`` (an ``(n, dim)``
+    float32 array) and ``postings`` (keyword posting lists as positions into
+    ``ids``).
+    """
+    dims = {shard["embeddings"].shape[1] for shard in shards if len(shard["ids"])}
+    if len(dims) > 1:
+        raise SnapshotError(f"Shards have different embedding dimensions: {sorted(dims)}")
+    dim = dims.pop() if dims else 0
+
+    matrices = [
+        np.ascontiguousarray(shard["embeddings"], dtype="<f4").reshape(len(shard["ids"]), dim)
+        for shard in shards
+    ]
+    embeddings = np.concatenate(matrices) if matrices else np.zeros((0, dim), dtype="<f4")
+
+    records = zlib.compress(json.dumps([
+        {"ids": shard["ids"], "documents": shard["documents"], "metadatas": shard["metadatas"]}
+        for shard in shards
+    ]).encode("utf-8"))
+    postings = zlib.compress(json.dumps([shard["postings"] for shard in shards]).encode("utf-8"))
+
+    shard_entries = []
+    start = 0
+    for shard in shards:
+        shard_entries.append({"name": shard["name"], "metadata": shard["metadata"], "start": start, "count": len(shard["ids"])})
+        start += len(shard["ids"])
+
+    embeddings_bytes = embeddings.tobytes()
+    records_offset = _align(len(embeddings_bytes))
+    postings_offset = records_offset + len(records)
+    payload_size = postings_offset + len(postings)
+
+    digest = hashlib.sha256()
+    digest.update(embeddings_bytes)
+    digest.update(b"\x00" * (records_offset - len(embeddings_bytes)))
+    digest.update(records)
+    digest.update(postings)
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.time(),
+        "count": int(embeddings.shape[0]),
+        "dim": dim,
+        "dtype": "float32",
+        "shards": shard_entries,
+        "sections": {
+            "embeddings": {"offset": 0, "size": len(embeddings_bytes)},
+            "records": {"offset": records_offset, "size": len(records)},
+            "postings": {"offset": postings_offset, "size": len(postings)}
+        },
+        "payload_size": payload_size,
+        "sha256": digest.hexdigest()
+    }
+    manifest_bytes = json.dumps(manifest).encode("utf-8")
+    payload_start = _align(_PREAMBLE.size + len(manifest_bytes))
+
+    # Write to a temporary file first so a crash never leaves a truncated snapshot behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(manifest_bytes)))
+        f.write(manifest_bytes)
+        f.write(b"\x00" * (payload_start - _PREAMBLE.size - len(manifest_bytes)))
+        f.write(embeddings_bytes)
+        f.write(b"\x00" * (records_offset - len(embeddings_bytes)))
+        f.write(records)
+        f.write(postings)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+class Snapshot:
+    """A memory-mapped, checksum-verified snapshot file.
+
+    ``embeddings`` is a read-only view straight into the mapped file, so
+    loading costs no copy until the vectors are handed to Chroma.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"Snapshot file is empty: {path}")
+        try:
+            self.manifest = self._read_manifest()
+            if verify:
+                self._verify()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if len(self._mmap) < _PREAMBLE.size:
+            raise SnapshotError("Snapshot file is truncated")
+        magic, version, _, manifest_size = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError("Not a snapshot file")
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})")
+        try:
+            manifest = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + manifest_size])
+        except ValueError:
+            raise SnapshotError("Snapshot manifest is corrupted")
+        self._payload_start = _align(_PREAMBLE.size + manifest_size)
+        if len(self._mmap) != self._payload_start + manifest["payload_size"]:
+            raise SnapshotError("Snapshot file size does not match its manifest")
+        return manifest
+
+    def _verify(self):
+        digest = hashlib.sha256()
+        view = memoryview(self._mmap)
+        try:
+            for start in range(self._payload_start, len(self._mmap), 1 << 24):
+                digest.update(view[start:start + (1 << 24)])
+        finally:
+            view.release()
+        if digest.hexdigest() != self.manifest["sha256"]:
+            raise SnapshotError("Snapshot checksum mismatch, the file is corrupted")
+
+    def _section(self, name: str) -> bytes:
+        section = self.manifest["sections"][name]
+        start = self._payload_start + section["offset"]
+        return self._mmap[start:start + section["size"]]
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        section = self.manifest["sections"]["embeddings"]
+        return np.frombuffer(
+            self._mmap,
+            dtype="<f4",
+            count=self.manifest["count"] * self.manifest["dim"],
+            offset=self._payload_start + section["offset"]
+        ).reshape(self.manifest["count"], self.manifest["dim"])
+
+    def shards(self) -> List[Dict[str, Any]]:
+        """Return every shard with its records, embedding rows and keyword postings."""
+        records = json.loads(zlib.decompress(self._section("records")))
+        postings = json.loads(zlib.decompress(self._section("postings")))
+        embeddings = self.embeddings
+        return [
+            {
+                "name": entry["name"],
+                "metadata": entry["metadata"],
+                "ids": shard_records["ids"],
+                "documents": shard_records["documents"],
+                "metadatas": shard_records["metadatas"],
+                "embeddings": embeddings[entry["start"]:entry["start"] + entry["count"]],
+                "postings": shard_postings
+            }
+            for entry, shard_records, shard_postings in zip(self.manifest["shards"], records, postings)
+        ]
+
+    def close(self):
+        # Views handed out by ``embeddings`` keep the map alive until they are released
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_collection(collection, page_size: int = EXPORT_PAGE_SIZE) -> Dict[str, Any]:
+    """Read every chunk of a Chroma collection, including its stored embeddings."""
+    ids: List[str] = []
+    documents: List[Optional[str]] = []
+    metadatas: List[Optional[Dict[str, Any]]] = []
+    embeddings: List[np.ndarray] = []
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["documents", "metadatas", "embeddings"],
+            limit=page_size,
+            offset=offset
+        )
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        embeddings.append(np.asarray(page["embeddings"], dtype="<f4"))
+        offset += len(page["ids"])
+    return {
+        "ids": ids,
+        "documents": documents,
+        "metadatas": metadatas,
+        "embeddings": np.concatenate(embeddings) if embeddings else np.zeros((0, 0), dtype="<f4")
+    }